@@ -0,0 +1,80 @@
+'''Runs the hm and ostia benchmarks and collects their results into one JSON file
+named after the current commit, so that runs on different commits can be
+compared.
+
+    python bench.py                       # writes bench-<commit>.json
+    python bench.py --compare bench-<older commit>.json
+    python bench.py --hm-args '--terms 100' --ostia-args '--pairs 200'
+'''
+import os
+import sys
+import json
+import shlex
+import argparse
+import tempfile
+import subprocess
+
+SUITES = ('hm', 'ostia')
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def run_suite(suite, extra_args):
+    '''Runs the bench.py of _suite_, returning the results it stores.'''
+    fd, path = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    try:
+        subprocess.check_call([sys.executable, 'bench.py', '--json', path] + extra_args,
+                              cwd=os.path.join(HERE, suite))
+        with open(path) as f:
+            return json.load(f)
+    finally:
+        os.remove(path)
+
+def compare(old, new, threshold):
+    '''Prints the change in time of each benchmark in both _old_ and _new_, marking
+those more than _threshold_ times slower. Returns the number of those.'''
+    regressions = 0
+    for suite in SUITES:
+        if suite not in old['suites'] or suite not in new['suites']: continue
+        old_results, new_results = old['suites'][suite]['results'], new['suites'][suite]['results']
+        for name in sorted(set(old_results) & set(new_results)):
+            before, after = old_results[name]['seconds'], new_results[name]['seconds']
+            ratio = after / before if before else float('inf')
+            slower = ratio > threshold
+            regressions += slower
+            print '%-6s %-24s %9.3fs -> %9.3fs %7.2fx%s' % (
+                suite, name, before, after, ratio, '  SLOWER' if slower else '')
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Runs the benchmark suites and compares results.')
+    parser.add_argument('--suites', nargs='+', choices=SUITES, default=list(SUITES))
+    parser.add_argument('--hm-args', default='', help='extra arguments for hm/bench.py')
+    parser.add_argument('--ostia-args', default='', help='extra arguments for ostia/bench.py')
+    parser.add_argument('--output', help='where to write the results (default bench-<commit>.json)')
+    parser.add_argument('--compare', metavar='FILE', help='results of an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=1.1,
+                        help='ratio of times above which a benchmark counts as slower')
+    args = parser.parse_args()
+
+    run = dict(commit=commit(), suites={})
+    for suite in args.suites:
+        print '== %s' % suite
+        sys.stdout.flush()
+        run['suites'][suite] = run_suite(suite, shlex.split(getattr(args, '%s_args' % suite)))
+
+    output = args.output or 'bench-%s.json' % run['commit']
+    with open(output, 'w') as f:
+        json.dump(run, f, indent=1, sort_keys=True)
+    print 'results written to %s' % output
+
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        print '== %s -> %s' % (old['commit'], run['commit'])
+        sys.exit(1 if compare(old, run, args.threshold) else 0)
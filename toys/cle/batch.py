@@ -0,0 +1,75 @@
+'''Decodes maximum spanning arborescences for a batch of sentences at once, straight
+from a padded array of arc scores. scores[b, h, d] is the score of the arc from
+head h to dependent d in sentence b, node 0 is the root, and sentence b has
+lengths[b] nodes (the root included).
+
+The best head of every node is chosen for the whole batch at once, and pointer
+doubling finds the sentences where those heads form a cycle. Only those are
+handed to the contraction algorithm in cle.
+
+>>> scores = numpy.array([[[0, 9, 1, 0], [0, 0, 8, 0], [0, 7, 0, 0], [0, 0, 0, 0]],
+...                       [[0, 3, 2, 1], [0, 0, 9, 1], [0, 8, 0, 9], [0, 1, 1, 0]]], dtype=float)
+>>> decode_batch(scores, [3, 4])
+array([[-1,  0,  1, -1],
+       [-1,  0,  1,  2]])
+'''
+import numpy
+
+from cle import _dmst
+
+def mask_scores(scores, lengths):
+    '''Returns a copy of _scores_ with -inf for every arc which cannot be in a tree:
+arcs into the root, self-loops, and arcs touching padding.'''
+    batch, n, _ = scores.shape
+    nodes = numpy.arange(n)
+    real = nodes[None, :] < numpy.asarray(lengths)[:, None]
+    allowed = real[:, :, None] & real[:, None, :]
+    allowed &= (nodes[:, None] != nodes[None, :])[None]
+    allowed[:, :, 0] = False
+    return numpy.where(allowed, scores, -numpy.inf)
+
+def has_cycle(heads, lengths):
+    '''Returns for each sentence whether following _heads_ from some node fails to
+reach the root. heads[b, 0] and the heads of padding must be 0.'''
+    batch, n = heads.shape
+    rows = numpy.arange(batch)[:, None]
+    ancestors = heads
+    # after 2^k >= n steps every node not under a cycle has reached the root
+    for _ in xrange(max(1, int(numpy.ceil(numpy.log2(n))))):
+        ancestors = ancestors[rows, ancestors]
+    return (ancestors != 0).any(axis=1)
+
+def decode(scores, length):
+    '''Returns the heads of the maximum spanning arborescence of one masked
+_length_ x _length_ score matrix by full contraction.'''
+    hs, ds = numpy.nonzero(numpy.isfinite(scores))
+    # maximise by minimising the negated scores
+    arcs = zip(hs.tolist(), ds.tolist(), (-scores[hs, ds]).tolist())
+    into = _dmst(length, 0, arcs)
+    if into is None:
+        raise ValueError('some node has no possible head')
+    return [ -1 ] + [ arcs[arc][0] for arc in into[1:] ]
+
+def decode_batch(scores, lengths):
+    '''Returns a (batch, n) array holding the head of each node of each sentence in
+the maximum spanning arborescence of its scores, or -1 for the root and padding.'''
+    scores = mask_scores(numpy.asarray(scores, dtype=float), lengths)
+    batch, n, _ = scores.shape
+    heads = scores.argmax(axis=1)
+    # the root, and padding, point at the root
+    unreachable = ~numpy.isfinite(scores.max(axis=1))
+    heads[unreachable] = 0
+
+    lengths = numpy.asarray(lengths)
+    if (unreachable[:, 1:] & (numpy.arange(1, n)[None, :] < lengths[:, None])).any():
+        raise ValueError('some node has no possible head')
+    for b in numpy.nonzero(has_cycle(heads, lengths))[0]:
+        length = lengths[b]
+        heads[b, :length] = decode(scores[b, :length, :length], length)
+
+    heads[unreachable] = -1
+    return heads
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
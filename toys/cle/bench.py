@@ -0,0 +1,224 @@
+'''Benchmarks the arborescence solvers of cle.py and batch.py.
+
+By default, times chu_liu_edmonds on dense random graphs against
+chu_liu_edmonds_by_contraction and the naive O(VE) contract-and-copy algorithm,
+checking that all find arborescences of the same weight.
+
+    python bench.py --nodes 50 100 200 300 --naive-up-to 200
+
+With --batch, times batch.decode_batch on random score arrays against building
+a Graph for each sentence.
+
+    python bench.py --batch 1000 --max-length 40
+
+With --k-best, enumerates the best trees of dense graphs with
+k_best_arborescences, counting how many times it ran the decoder.
+
+    python bench.py --k-best 50 --nodes 50 100
+
+With --memory, reports the peak memory and the CPU times of building and
+solving a dense Graph and ArrayGraph.
+
+    python bench.py --memory 1000
+'''
+import time
+import random
+import argparse
+import resource
+from itertools import islice
+
+from cle import *
+
+def dense_graph(n, seed=0, graph_class=Graph):
+    '''Returns a complete graph on _n_ nodes, 0 being the root, with random weights.'''
+    r = random.Random(seed)
+    g = graph_class()
+    for u in xrange(n):
+        for v in xrange(1, n):
+            if u != v: g.add(u, v, r.random())
+    return g
+
+def naive_cle(nodes, root, arcs):
+    '''Returns the arcs of the maximum spanning arborescence of _nodes_ rooted at _root_,
+where _arcs_ is a list of (u, v, weight), by choosing the best arc into each node,
+then contracting a cycle among them into a new node, copying the arcs, and
+solving again.'''
+    best = {}
+    for arc in arcs:
+        u, v, weight = arc
+        if v != root and u != v and (v not in best or weight > best[v][2]):
+            best[v] = arc
+
+    # look for a cycle among the best arcs
+    cycle = None
+    for start in best:
+        path, v = [], start
+        while v in best and v not in path:
+            path.append(v)
+            v = best[v][0]
+        if v in path:
+            cycle = path[path.index(v):]
+            break
+    if cycle is None:
+        return best.values()
+
+    members = set(cycle)
+    c = ('cycle', len(nodes))
+    contracted, origin = [], {}
+    for arc in arcs:
+        u, v, weight = arc
+        if u in members and v in members: continue
+        if v in members:
+            new = (u, c, weight - best[v][2])
+        elif u in members:
+            new = (c, v, weight)
+        else:
+            new = arc
+        # keep only the best of parallel arcs
+        key = new[:2]
+        if key not in origin or new[2] > origin[key][0][2]:
+            origin[key] = (new, arc)
+    contracted = [ new for (new, arc) in origin.itervalues() ]
+
+    result = []
+    for new in naive_cle([ v for v in nodes if v not in members ] + [c], root, contracted):
+        arc = origin[new[:2]][1]
+        result.append(arc)
+        if new[1] == c:
+            # the arc into the cycle displaces the cycle's arc into the same node
+            entered = arc[1]
+    result.extend( best[v] for v in cycle if v != entered )
+    return result
+
+def random_scores(batch, max_length, strength=3., seed=0):
+    '''Returns (scores, lengths) for _batch_ sentences of up to _max_length_ nodes, each
+scoring the arcs of a random tree _strength_ higher on average than the rest.'''
+    import numpy
+    r = numpy.random.RandomState(seed)
+    lengths = r.randint(2, max_length + 1, size=batch)
+    scores = r.normal(size=(batch, max_length, max_length))
+    for b, length in enumerate(lengths):
+        for d in xrange(1, length):
+            scores[b, r.randint(0, d), d] += strength
+    return scores, lengths
+
+def tree_score(scores, heads):
+    return sum(scores[h, d] for (d, h) in enumerate(heads) if h >= 0)
+
+def time_batch(batch, max_length, strength, seed):
+    import numpy
+    from batch import decode_batch, mask_scores, has_cycle
+    scores, lengths = random_scores(batch, max_length, strength, seed)
+
+    start = time.time()
+    heads = decode_batch(scores, lengths)
+    batched = time.time() - start
+
+    start = time.time()
+    for b, length in enumerate(lengths):
+        g = Graph()
+        for h in xrange(length):
+            for d in xrange(1, length):
+                if h != d: g.add(h, d, scores[b, h, d])
+        tree = chu_liu_edmonds(g, 0)
+        if abs(sum(arc.weight for arc in tree.itervalues()) - tree_score(scores[b], heads[b])) > 1e-6:
+            print 'sentence %d: scores differ' % b
+    graphs = time.time() - start
+
+    masked = mask_scores(scores, lengths)
+    greedy = masked.argmax(axis=1)
+    greedy[:, 0] = 0
+    greedy[numpy.arange(masked.shape[1])[None, :] >= lengths[:, None]] = 0
+    cyclic = has_cycle(greedy, lengths).sum()
+    print '%d sentences of up to %d nodes, %d with cycles: %8.3fs batched, %8.3fs with Graphs' % (
+        batch, max_length, cyclic, batched, graphs)
+
+def cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+    
+def build_and_solve(n, seed, graph_class):
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = cpu_time()
+    g = dense_graph(n, seed, graph_class)
+    built = cpu_time() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before
+    start = cpu_time()
+    tree = chu_liu_edmonds(g, 0)
+    return peak, built, cpu_time() - start, sum(arc.weight for arc in tree.itervalues())
+
+def time_memory(n, seed):
+    '''Builds and solves a dense graph on _n_ nodes as a Graph and as an ArrayGraph,
+each in a process of its own so that the growth in peak memory of one does not
+hide that of the other. Times are CPU times, as the two run one after the other
+and a busy machine would otherwise favour one.'''
+    from multiprocessing import Pool
+    for graph_class in (Graph, ArrayGraph):
+        pool = Pool(1)
+        peak, built, solved, weight = pool.apply(build_and_solve, (n, seed, graph_class))
+        pool.close()
+        print '%-10s %4d nodes: +%7d KB, %8.3fs to build, %8.3fs to solve, weight %.6f' % (
+            graph_class.__name__, n, peak, built, solved, weight)
+
+def time_k_best(n, k, seed):
+    g = dense_graph(n, seed)
+    stats = {}
+    start = time.time()
+    weights = [ weight for (weight, tree) in islice(k_best_arborescences(g, 0, stats), k) ]
+    t = time.time() - start
+    start = time.time()
+    chu_liu_edmonds(g, 0)
+    one = time.time() - start
+    print '%4d nodes, %d best trees: %8.3fs (%.1f single decodes), %d decoded, weights %.3f..%.3f' % (
+        n, len(weights), t, t / one, stats['solved'], weights[0], weights[-1])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks chu_liu_edmonds on dense graphs.')
+    parser.add_argument('--nodes', type=int, nargs='+', default=[50, 100, 200, 300])
+    parser.add_argument('--naive-up-to', type=int, default=200,
+                        help='largest graph to also solve by contraction and with the naive algorithm')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--batch', type=int, default=0,
+                        help='number of sentences to decode in a batch instead')
+    parser.add_argument('--max-length', type=int, default=40)
+    parser.add_argument('--strength', type=float, default=3.,
+                        help='how much higher a hidden tree scores than the other arcs')
+    parser.add_argument('--k-best', type=int, default=0,
+                        help='number of best trees of each dense graph to enumerate instead')
+    parser.add_argument('--memory', type=int, default=0,
+                        help='number of nodes of a dense graph to compare Graph and ArrayGraph on instead')
+    args = parser.parse_args()
+
+    if args.k_best:
+        for n in args.nodes:
+            time_k_best(n, args.k_best, args.seed)
+        args.nodes = []
+
+    if args.memory:
+        time_memory(args.memory, args.seed)
+        args.nodes = []
+
+    if args.batch:
+        time_batch(args.batch, args.max_length, args.strength, args.seed)
+        args.nodes = []
+
+    for n in args.nodes:
+        g = dense_graph(n, args.seed)
+        start = time.time()
+        tree = chu_liu_edmonds(g, 0)
+        t = time.time() - start
+        weight = sum(arc.weight for arc in tree.itervalues())
+        print '%4d nodes %7d arcs: %8.3fs' % (n, n * (n - 1) - (n - 1), t),
+
+        if n <= args.naive_up_to:
+            start = time.time()
+            contracted = sum(arc.weight for arc in chu_liu_edmonds_by_contraction(g, 0).itervalues())
+            print ' by contraction %8.3fs%s' % (time.time() - start,
+                                                '' if abs(contracted - weight) < 1e-6 else ' WEIGHTS DIFFER'),
+            
+            arcs = [ (arc.u, arc.v, arc.weight) for v in g.nodes() for arc in g.each_incoming(v) ]
+            start = time.time()
+            naive = sum(arc[2] for arc in naive_cle(list(g.nodes()), 0, arcs))
+            print ' naive %8.3fs%s' % (time.time() - start,
+                                       '' if abs(naive - weight) < 1e-6 else ' WEIGHTS DIFFER'),
+        print
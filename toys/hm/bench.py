@@ -0,0 +1,224 @@
+'''Benchmarks the lambda-term parsers on random well-typed terms, reporting terms/s;
+type inference on random well-typed and ill-typed terms and on deep, wide and
+let-bound synthetic terms, reporting nodes/s; and incremental re-checking of a
+wide term after small edits. --json stores the results for comparison.
+
+    python bench.py --terms 500 --depth 5 --width 2 --variables 4 --json hm.json
+'''
+import sys
+import time
+import random
+import argparse
+import json
+from itertools import count, imap
+
+from hm import *
+from fastparse import FastParser
+from incremental import IncrementalTypeChecker, edit
+
+class TermGenerator(object):
+    '''Generates the text of random terms from a seed. A well-typed term is built
+top-down from a random simple type: it takes _variables_ arguments of random
+types, nests at most _depth_ deep, and applies functions to at most _width_
+arguments at once. An ill-typed term is a well-typed one with a single fault,
+either a literal in function position or an unbound variable.
+
+Every lambda binds a name of its own, so terms check the same whether scoping is
+lexical or not.'''
+    def __init__(self, seed=0, depth=6, width=3, variables=4):
+        self.r = random.Random(seed)
+        self.depth, self.width, self.variables = depth, width, variables
+        
+    def random_type(self, depth=2):
+        if depth == 0 or self.r.random() < .5:
+            return self.r.choice((INT, REAL))
+        return FunctionType(self.random_type(depth - 1), self.random_type(depth - 1))
+        
+    def well_typed(self):
+        return self.generate(fault=None)
+        
+    def ill_typed(self):
+        # generate the term once to count its applications, then again from the
+        # same state, putting the fault in place of one of them
+        state = self.r.getstate()
+        self.generate(fault=None)
+        fault = self.r.randrange(max(1, self.applications))
+        self.r.setstate(state)
+        return self.generate(fault)
+        
+    def generate(self, fault):
+        self.fault, self.applications, self.names = fault, 0, count(0)
+        env = [ ('v%d' % i, self.random_type()) for i in xrange(self.variables) ]
+        body = self.term(self.random_type(), env, self.depth)
+        if self.fault is not None:
+            # no applications to spoil: apply a literal to the whole term
+            body = '(1 %s)' % body
+        return ''.join('\\%s -> ' % name for name, _ in env) + body
+        
+    def term(self, type, env, depth):
+        r = self.r
+        if depth <= 0 or r.random() < .2:
+            names = [ name for (name, t) in env if t == type ]
+            if names and (r.random() < .7 or isinstance(type, FunctionType)):
+                return r.choice(names)
+            if type == INT: return str(r.randrange(100))
+            if type == REAL: return '.%d' % r.randrange(100)
+            
+        # out of depth, a function can still be a lambda around a leaf
+        if isinstance(type, FunctionType) and (depth <= 0 or r.random() < .5):
+            name = 'x%d' % self.names.next()
+            return '\\%s -> %s' % (name, self.term(type.restype, env + [ (name, type.argtype) ], depth - 1))
+            
+        argtypes = [ self.random_type(1) for _ in xrange(r.randint(1, self.width)) ]
+        fntype = type
+        for argtype in reversed(argtypes):
+            fntype = FunctionType(argtype, fntype)
+        fn = self.term(fntype, env, depth - 1)
+        args = [ self.term(argtype, env, depth - 1) for argtype in argtypes ]
+        
+        if self.applications == self.fault:
+            fn = r.choice(('1', 'unbound'))
+            self.fault = None
+        self.applications += 1
+        return '%s%s %s)' % ('(' * len(args), fn, ') '.join(args))
+
+def deep_term(n):
+    '''Returns a left-nested chain of _n_ applications under _n_ lambdas.'''
+    names = [ 'x%d' % i for i in xrange(n) ]
+    return '%s%sf %s)' % (
+        ''.join('\\%s -> ' % name for name in ['f'] + names),
+        '(' * n, ') '.join(names))
+
+def wide_term(depth):
+    '''Returns a balanced tree of applications _depth_ levels deep.'''
+    term = 'x'
+    for _ in xrange(depth):
+        term = '((k %s) %s)' % (term, term)
+    return '\\k -> \\x -> %s' % term
+
+def let_term(n):
+    '''Returns a chain of _n_ lets, each defining a function which applies the
+previous one twice.'''
+    lets = [ 'let f%d = \\x -> (f%d (f%d x)) in ' % (i, i - 1, i - 1) for i in xrange(1, n) ]
+    return 'let f0 = \\x -> x in %s\\g -> ((g (f%d 1)) (f%d .5))' % (''.join(lets), n - 1, n - 1)
+
+def inlined_term(n):
+    '''Returns let_term(_n_) with every let inlined, so 2^_n_ times the size.'''
+    f = '\\x -> x'
+    for _ in xrange(1, n):
+        f = '\\x -> (%s (%s x))' % (f, f)
+    return '\\g -> ((g (%s 1)) (%s .5))' % (f, f)
+
+def count_nodes(term):
+    n, terms = 0, [term]
+    while terms:
+        term = terms.pop()
+        n += 1
+        if isinstance(term, Lambda): terms.append(term.body)
+        elif isinstance(term, Let): terms.extend( (term.value, term.body) )
+        elif isinstance(term, Apply): terms.extend( (term.fn, term.arg) )
+    return n
+
+def time_checker(term, checker=None):
+    start = time.time()
+    (checker or HMTypeChecker()).check_type(term)
+    return time.time() - start
+
+def random_leaf_path(r, root, name):
+    '''Returns the attributes leading from _root_ to a random occurrence of _name_.'''
+    while True:
+        path, term = [], root
+        while isinstance(term, (Lambda, Apply)):
+            attr = 'body' if isinstance(term, Lambda) else r.choice(('fn', 'arg'))
+            path.append(attr)
+            term = getattr(term, attr)
+        if isinstance(term, Var) and term.name == name: return path
+
+def time_edits(r, term, n_edits, leaf):
+    '''Grows _term_ by replacing random leaves with copies of _leaf_, timing a full
+check and an incremental re-check of each version.'''
+    checker = IncrementalTypeChecker()
+    checker.check_type(term)
+    full = incremental = 0.
+    for _ in xrange(n_edits):
+        path = random_leaf_path(r, term, 'x')
+        term = edit(term, path, FastParser().parse(leaf))
+        full += time_checker(term)
+        incremental += time_checker(term, checker)
+    return full, incremental, checker
+
+def time_parser(parser, terms):
+    start = time.time()
+    for term in parser.parse_many(terms): pass
+    return time.time() - start
+
+def record(results, name, seconds, n, unit):
+    '''Prints and stores under _name_ a timing of _seconds_ for _n_ _unit_s.'''
+    rate = n / seconds if seconds else float('inf')
+    results[name] = dict(seconds=seconds, count=n, unit=unit, rate=rate)
+    print '  %-24s %9.3fs %12.0f %s/s' % (name, seconds, rate, unit)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks the lambda-term parsers and type checkers.')
+    parser.add_argument('--terms', type=int, default=500)
+    parser.add_argument('--depth', type=int, default=5)
+    parser.add_argument('--width', type=int, default=2)
+    parser.add_argument('--variables', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--deep', type=int, nargs='*', default=[1000, 5000],
+                        help='lengths of the application chains to type check')
+    parser.add_argument('--wide', type=int, nargs='*', default=[10, 13],
+                        help='depths of the application trees to type check')
+    parser.add_argument('--lets', type=int, nargs='*', default=[10, 1000],
+                        help='lengths of the let chains to type check (inlined too, up to 12)')
+    parser.add_argument('--edits', type=int, default=20,
+                        help='edits to make to the widest tree, rechecking incrementally')
+    parser.add_argument('--json', metavar='FILE', help='also write the results to FILE')
+    args = parser.parse_args()
+    results = {}
+
+    g = TermGenerator(args.seed, args.depth, args.width, args.variables)
+    well_typed = [ g.well_typed() for _ in xrange(args.terms) ]
+    ill_typed = [ g.ill_typed() for _ in xrange(args.terms) ]
+    print '%d well-typed and %d ill-typed terms, %d chars' % (
+        len(well_typed), len(ill_typed), sum(imap(len, well_typed + ill_typed)))
+        
+    parsers = [ ('fast', FastParser()) ]
+    try:
+        from parse import Parser
+        parsers.insert(0, ('ply', Parser()))
+    except ImportError:
+        print >>sys.stderr, 'PLY not available, skipping its parser'
+    for name, p in parsers:
+        record(results, 'parse.%s' % name, time_parser(p, well_typed), len(well_typed), 'terms')
+
+    for kind, texts in (('well_typed', well_typed), ('ill_typed', ill_typed)):
+        terms = list(FastParser().parse_many(texts))
+        n, failures = sum(imap(count_nodes, terms)), 0
+        start = time.time()
+        for term in terms:
+            try:
+                HMTypeChecker().check_type(term)
+            except TypeCheckerException:
+                failures += 1
+        record(results, 'check.%s' % kind, time.time() - start, n, 'nodes')
+        results['check.%s' % kind]['failures'] = failures
+
+    for kind, make, sizes in (('deep', deep_term, args.deep), ('wide', wide_term, args.wide),
+                              ('let', let_term, args.lets),
+                              ('inlined', inlined_term, [ n for n in args.lets if n <= 12 ])):
+        for size in sizes:
+            term = FastParser().parse(make(size))
+            record(results, 'check.%s.%d' % (kind, size), time_checker(term), count_nodes(term), 'nodes')
+
+    if args.edits and args.wide:
+        r = random.Random(args.seed)
+        term = FastParser().parse(wide_term(max(args.wide)))
+        full, incremental, checker = time_edits(r, term, args.edits, '((k x) x)')
+        record(results, 'edits.full', full, args.edits, 'edits')
+        record(results, 'edits.incremental', incremental, args.edits, 'edits')
+        results['edits.incremental']['hit_rate'] = checker.hit_rate()
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(dict(parameters=vars(args), results=results), f, indent=1, sort_keys=True)
@@ -0,0 +1,244 @@
+# A hand-written parser for the lambda-term grammar in parse.py, producing the
+# same AST as the PLY parser. The lexer is a single compiled regex and both the
+# term and the type grammar are parsed with explicit stacks, so arbitrarily deep
+# nesting never meets the recursion limit.
+#
+# The PLY grammar resolves its shift/reduce conflicts by shifting, so the arrows
+# of a type are right associative and greedy; this parser does the same.
+
+import sys
+import re
+from itertools import imap, count
+
+from hm import *
+
+def warn(msg, *args):
+    print >>sys.stderr, "warning: %s" % (msg % args)
+
+def err(msg, *args):
+    print >>sys.stderr, "error: %s" % (msg % args)
+
+# alternatives in the order PLY tries the t_ rules in parse.py
+TOKEN = re.compile(r'''[ \t\r\v\f\n]*(?:
+    (?P<NAME>[a-zA-Z][a-zA-Z0-9]*) |
+    (?P<INT>\d+) |
+    (?P<LAMBDA>\\) |
+    (?P<LPA>\() |
+    (?P<RPA>\)) |
+    (?P<REAL>\.\d+) |
+    (?P<COLON>:) |
+    (?P<ARROW>->) |
+    (?P<BACKTICK>[`']) |
+    (?P<EQUALS>=))''', re.VERBOSE)
+IGNORED = re.compile(r'[ \t\r\v\f\n]*')
+RESERVED = { 'let': 'LET', 'in': 'IN' }
+END = 'END'
+
+def tokenise(s):
+    '''Returns the (type, value) tokens of _s_ followed by an END token.
+
+>>> tokenise("\\\\x:'a -> (x .5)")
+[('LAMBDA', '\\\\'), ('NAME', 'x'), ('COLON', ':'), ('BACKTICK', "'"), ('NAME', 'a'), ('ARROW', '->'), ('LPA', '('), ('NAME', 'x'), ('REAL', '.5'), ('RPA', ')'), ('END', None)]
+    '''
+    tokens = []
+    pos, n = 0, len(s)
+    match = TOKEN.match
+    while True:
+        m = match(s, pos)
+        if m is None:
+            pos = IGNORED.match(s, pos).end()
+            if pos == n: break
+            warn("Illegal character `%s' encountered.", s[pos])
+            pos += 1
+            continue
+        type, value = m.lastgroup, m.group(m.lastgroup)
+        if type == 'NAME': type = RESERVED.get(value, type)
+        tokens.append( (type, value) )
+        pos = m.end()
+    tokens.append( (END, None) )
+    return tokens
+
+class ParseError(Exception): pass
+
+# frames on the term stack
+APPLY_FN, APPLY_ARG, LAMBDA_BODY, LET_VALUE, LET_BODY = range(5)
+
+class FastParser(object):
+    '''A drop-in replacement for parse.Parser which does not need PLY.
+
+>>> p = FastParser()
+>>> p.parse('(\\\\f -> (f 1) \\\\x -> x)')
+(\(f:(`_v0) . (f:(None) 1)) \(x:(`_v1) . x:(None)))
+>>> p.parse('(x')
+>>> list(p.parse_many(['.5', 'y']))
+[0.5, y:(None)]
+>>> p.parse('let id = \\\\x -> x in (id 1)')
+let id = \(x:(`_v0) . x:(None)) in (id:(None) 1)
+    '''
+    def parse(self, s, stats=None):
+        '''Returns the term _s_ parses to, timing the lexing and parsing into _stats_
+if it is given.'''
+        if stats is None:
+            return self.parse_tokens(tokenise(s))
+        with stats.timed('lex'):
+            tokens = tokenise(s)
+        with stats.timed('parse'):
+            return self.parse_tokens(tokens)
+            
+    def parse_tokens(self, tokens):
+        self.freshvars = imap(lambda e: TypeVar('_v'+str(e)), count(0))
+        self.tokens = tokens
+        self.pos = 0
+        try:
+            term = self.term()
+            self.expect(END)
+            return term
+        except ParseError, e:
+            err("Syntax error encountered: %s", e.args[0])
+            return None
+
+    def parse_many(self, strings):
+        for s in strings:
+            yield self.parse(s)
+
+    def next(self):
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return token
+
+    def peek(self):
+        return self.tokens[self.pos][0]
+
+    def expect(self, type):
+        token = self.next()
+        if token[0] != type:
+            raise ParseError(token)
+        return token
+
+    def term(self):
+        # term ::= LPA term term RPA | LAMBDA vardef ARROW term
+        #        | LET NAME EQUALS term IN term | value
+        stack = []
+        while True:
+            type, value = self.next()
+            if type == 'LPA':
+                stack.append([APPLY_FN, None])
+                continue
+            elif type == 'LAMBDA':
+                var = self.vardef()
+                self.expect('ARROW')
+                stack.append([LAMBDA_BODY, var])
+                continue
+            elif type == 'LET':
+                name = self.expect('NAME')[1]
+                self.expect('EQUALS')
+                stack.append([LET_VALUE, name, None])
+                continue
+            elif type == 'INT':
+                term = Integer(int(value))
+            elif type == 'REAL':
+                term = Real(float(value))
+            elif type == 'NAME':
+                term = Var(value)
+            else:
+                raise ParseError( (type, value) )
+
+            # a complete term: fold it into the frames it finishes
+            while stack:
+                frame = stack[-1]
+                if frame[0] == APPLY_FN:
+                    frame[0], frame[1] = APPLY_ARG, term
+                    break
+                elif frame[0] == LET_VALUE:
+                    self.expect('IN')
+                    frame[0], frame[2] = LET_BODY, term
+                    break
+                stack.pop()
+                if frame[0] == APPLY_ARG:
+                    self.expect('RPA')
+                    term = Apply(frame[1], term)
+                elif frame[0] == LET_BODY:
+                    term = Let(frame[1], frame[2], term)
+                else:
+                    term = Lambda(frame[1], term)
+            else:
+                return term
+
+    def varname(self):
+        # varname ::= NAME | BACKTICK NAME
+        type, value = self.next()
+        if type == 'NAME':
+            return AtomicType(value)
+        elif type == 'BACKTICK':
+            return TypeVar(self.expect('NAME')[1])
+        raise ParseError( (type, value) )
+
+    def vardef(self):
+        # vardef ::= varname COLON type | varname
+        name = self.varname()
+        if self.peek() == 'COLON':
+            self.next()
+            return Var(name, self.type())
+        return Var(name, self.freshvars.next())
+
+    def type(self):
+        # type ::= varname | type ARROW type | LPA type ARROW type RPA
+        # each level holds the operands of one arrow chain; the outermost is
+        # the type itself, the others are open parentheses
+        levels = [ [] ]
+        while True:
+            if self.peek() == 'LPA':
+                self.next()
+                levels.append([])
+                continue
+            operand = self.varname()
+
+            while True:
+                levels[-1].append(operand)
+                if self.peek() == 'ARROW':
+                    self.next()
+                    break
+
+                operands = levels.pop()
+                operand = operands.pop()
+                while operands:
+                    operand = FunctionType(operands.pop(), operand)
+                if not levels:
+                    return operand
+                # a parenthesised type needs an arrow inside it
+                if len(operands) == 0 and not isinstance(operand, FunctionType):
+                    raise ParseError(self.tokens[self.pos])
+                self.expect('RPA')
+
+def differential(n_terms=2000, seed=0):
+    '''Parses random terms with both FastParser and the PLY parser, returning the
+terms on which they disagree.'''
+    import random
+    from parse import Parser
+    r = random.Random(seed)
+
+    def random_term(depth):
+        choice = r.randrange(6 if depth < 6 else 3)
+        if choice == 0: return str(r.randrange(100))
+        if choice == 1: return '.%d' % r.randrange(100)
+        if choice == 2: return r.choice('xyzfg')
+        if choice == 3: return '\\%s -> %s' % (r.choice('xyzfg'), random_term(depth + 1))
+        if choice == 4 and r.random() < .3:
+            return 'let %s = %s in %s' % (r.choice('xyzfg'), random_term(depth + 1), random_term(depth + 1))
+        return '(%s %s)' % (random_term(depth + 1), random_term(depth + 1))
+
+    terms = [ random_term(0) for _ in xrange(n_terms) ]
+    # and some that neither parser should accept
+    terms.extend(['(x', 'x)', '(x y z)', '\\x:int -> x', '\\x:(a -> b) -> x', '->', '',
+                  'let x = 1 x', 'let x = 1 in', '(let x = 1 in x'])
+
+    slow, fast = Parser(), FastParser()
+    return [ term for term in terms if repr(slow.parse(term)) != repr(fast.parse(term)) ]
+
+if __name__ == '__main__':
+    if '-t' in sys.argv[1:]:
+        import doctest
+        doctest.testmod()
+        print 'disagreements:', differential()
+    else:
+        print FastParser().parse(sys.argv[1])
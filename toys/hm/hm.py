@@ -1,4 +1,8 @@
-from itertools import imap, count
+import time
+from itertools import imap, izip, count
+from weakref import WeakValueDictionary
+from collections import defaultdict
+from contextlib import contextmanager
 
 class FreshVars(object):
     '''Provides a source of strings of the form pref0, pref1, ...'''
@@ -8,24 +12,49 @@ class FreshVars(object):
     def __iter__(self):
         return imap(lambda e: self.prefix+str(e), count(0))
 
-class TypeVar(object):
+class Type(object):
+    '''Base of the type universe. Types are immutable and hash-consed: constructing a
+type structurally equal to a live one returns that very object, so equality is
+identity and hashing is O(1).'''
+    __slots__ = ('__weakref__',)
+    
+    @classmethod
+    def intern(cls, key, *fields):
+        '''Returns the live instance of _cls_ for _key_, creating it from _fields_
+(the values of its __slots__, in order) if there is none.'''
+        self = cls.interned.get(key)
+        if self is None:
+            self = object.__new__(cls)
+            for name, value in zip(cls.__slots__, fields):
+                object.__setattr__(self, name, value)
+            cls.interned[key] = self
+        return self
+        
+    def __setattr__(self, name, value):
+        raise AttributeError('types are immutable')
+
+class TypeVar(Type):
     '''Represents a type variable `a.'''
+    __slots__ = ('typevarname',)
+    interned = WeakValueDictionary()
     newvars = iter(FreshVars('_a'))
+    # whether the type contains no type variables
+    ground = False
     
-    def __init__(self, typevarname=None):
+    def __new__(cls, typevarname=None):
         if not typevarname:
-            typevarname = self.newvars.next()
-        self.typevarname = typevarname
+            typevarname = cls.newvars.next()
+        return cls.intern(typevarname, typevarname)
+    
+    @classmethod
+    def reset_newvars(cls):
+        '''Restarts the names given to anonymous type variables at _a0.'''
+        cls.newvars = iter(FreshVars('_a'))
+    def __reduce__(self):
+        return (TypeVar, (self.typevarname,))
     
     def __repr__(self, brackets=False):
         return '`' + self.typevarname
-    
-    def __eq__(self, other):
-        if not isinstance(other, TypeVar): return False
-        return self.typevarname == other.typevarname
-    def __ne__(self, other): return not self == other
-    def __hash__(self):
-        return hash(self.typevarname)
         
     def occurs_check(self, typevar, type):
         '''Determines if _typevar_ occurs within _type_.'''
@@ -50,16 +79,16 @@ class TypeVar(object):
         
         return value.apply(subst)
 
-class AtomicType(object):
+class AtomicType(Type):
     '''Represents an atomic type.'''
-    def __init__(self, typename):
-        self.typename = typename
+    __slots__ = ('typename',)
+    interned = WeakValueDictionary()
+    ground = True
     
-    def __eq__(self, other):
-        if not isinstance(other, AtomicType): return False
-        return self.typename == other.typename
-    def __ne__(self, other):
-        return not self == other
+    def __new__(cls, typename):
+        return cls.intern(typename, typename)
+    def __reduce__(self):
+        return (AtomicType, (self.typename,))
     
     def apply(self, subst):
         '''Applies a unifier to this atomic type.'''
@@ -68,27 +97,84 @@ class AtomicType(object):
     def __repr__(self, brackets=False):
         return self.typename
 
-class FunctionType(object):
+class FunctionType(Type):
     '''Represents a function type Arg -> Res.'''
-    def __init__(self, argtype, restype):
-        self.argtype = argtype
-        self.restype = restype
+    __slots__ = ('argtype', 'restype', 'ground')
+    interned = WeakValueDictionary()
     
-    def __eq__(self, other):
-        if not isinstance(other, FunctionType): return False
-        return self.argtype == other.argtype and self.restype == other.restype
-    def __ne__(self, other):
-        return not self == other
+    def __new__(cls, argtype, restype):
+        # the parts are interned already, so they can key the table themselves
+        return cls.intern( (argtype, restype), argtype, restype,
+                           argtype.ground and restype.ground )
+    def __reduce__(self):
+        return (FunctionType, (self.argtype, self.restype))
     
     def apply(self, subst):
         '''Applies a unifier to this function type.'''
-        return FunctionType(self.argtype.apply(subst), self.restype.apply(subst))
+        if self.ground: return self
+        argtype, restype = self.argtype.apply(subst), self.restype.apply(subst)
+        if argtype is self.argtype and restype is self.restype: return self
+        return FunctionType(argtype, restype)
     
     def __repr__(self, brackets=False):
-        return '%s%s -> %s%s' % (
-            '(' if brackets else '',
-            self.argtype.__repr__(brackets=True), self.restype,
-            ')' if brackets else '')
+        # walk the restype spine rather than recursing down it
+        parts, type = [], self
+        while isinstance(type, FunctionType):
+            parts.append(type.argtype.__repr__(brackets=True))
+            type = type.restype
+        parts.append(repr(type))
+        return ('(%s)' if brackets else '%s') % ' -> '.join(parts)
+
+INT, REAL, LIST = AtomicType('int'), AtomicType('real'), AtomicType('list')
+
+def substitute(type, mapping):
+    '''Returns _type_ with each of its type variables _v_ replaced by _mapping_[_v_].
+Ground subtypes are shared with _type_ rather than rebuilt.'''
+    if type.ground: return type
+    results, stack = [], [ (type, False) ]
+    while stack:
+        type, expanded = stack.pop()
+        if expanded:
+            restype, argtype = results.pop(), results.pop()
+            results.append(FunctionType(argtype, restype))
+        elif isinstance(type, TypeVar):
+            results.append(mapping[type])
+        elif isinstance(type, FunctionType) and not type.ground:
+            stack.extend( ((type, True), (type.restype, False), (type.argtype, False)) )
+        else:
+            results.append(type)
+    return results.pop()
+
+def type_vars(type):
+    '''Returns the type variables of _type_ in order of first appearance.'''
+    seen, types = [], [type]
+    while types:
+        type = types.pop()
+        if isinstance(type, TypeVar):
+            if type not in seen: seen.append(type)
+        elif isinstance(type, FunctionType) and not type.ground:
+            types.extend( (type.restype, type.argtype) )
+    return seen
+
+class Instance(dict):
+    '''A substitution which leaves the variables it does not mention alone.'''
+    def __missing__(self, typevar):
+        return typevar
+
+class Scheme(object):
+    '''Represents the type scheme forall _quantified_ . _type_ of a let-bound variable.'''
+    def __init__(self, quantified, type):
+        self.quantified = quantified
+        self.type = type
+        
+    def instantiate(self, newvars):
+        '''Returns _type_ with its quantified variables replaced by ones drawn from
+_newvars_. The parts of _type_ without quantified variables are shared.'''
+        if not self.quantified: return self.type
+        return substitute(self.type, Instance(izip(self.quantified, newvars)))
+        
+    def __repr__(self):
+        return 'forall %s . %s' % (' '.join(imap(repr, self.quantified)), self.type)
 
 class Primitive(object): pass
 class Integer(Primitive):
@@ -96,7 +182,7 @@ class Integer(Primitive):
         self.value = value
     
     @staticmethod
-    def type(): return AtomicType('int')
+    def type(): return INT
     
     def __repr__(self): return str(self.value)
     
@@ -105,13 +191,13 @@ class Real(Primitive):
         self.value = value
 
     @staticmethod
-    def type(): return AtomicType('real')
+    def type(): return REAL
 
     def __repr__(self): return str(self.value)
 
 class List(Primitive):
     @staticmethod
-    def type(): return AtomicType('list')
+    def type(): return LIST
 
 class Var(object):
     '''Represents a reference to a previously bound variable.'''
@@ -144,81 +230,290 @@ class Apply(object):
     def __repr__(self):
         return '(%s %s)' % (self.fn, self.arg)
 
+class Let(object):
+    '''Represents let name = value in body, where _name_ is polymorphic in _body_.'''
+    def __init__(self, name, value, body):
+        self.name = name
+        self.value = value
+        self.body = body
+    
+    def __repr__(self):
+        return 'let %s = %s in %s' % (self.name, self.value, self.body)
+
 class TypeCheckerException(RuntimeError): pass
-class HMTypeChecker(object):
-    def unify(self, typeqs):
-        '''Computes the most general unifier for _typeqs_, a set of type equations.'''
-        unifier = {}
+class Unifier(object):
+    '''A union-find structure over type variables. Each bound type variable links to
+the type it was unified with; find() follows the links to the representative,
+compressing the path behind it, and the occurs check is only run when a variable
+is bound to a non-variable type.
+
+Type variables introduced inside the value of a let are given the let depth in
+_levels_ (fresh variables without one are at depth 0; a variable from a lambda
+annotation always has one, the least depth it appears at, so meeting it again
+deeper in never raises it). Unifying a variable with a type lowers the variables in
+that type to its depth, so after a let value has been checked, the variables still
+deeper than the let are exactly those which can be generalised.'''
+    # the worklist of equations; ProfilingUnifier counts what is taken from it
+    Equations = list
+    
+    def __init__(self):
+        self.links = {}
+        self.levels = {}
+        
+    def find(self, type):
+        '''Returns the representative of _type_.'''
+        root = type
+        while isinstance(root, TypeVar) and root in self.links:
+            root = self.links[root]
+        # point everything on the path straight at the representative
+        while type is not root and isinstance(type, TypeVar):
+            self.links[type], type = root, self.links[type]
+        return root
+        
+    def occurs(self, typevar, type):
+        '''Determines if _typevar_ occurs within _type_ under this unifier.'''
+        types = [type]
+        while types:
+            type = self.find(types.pop())
+            if type == typevar: return True
+            if isinstance(type, FunctionType):
+                types.extend( (type.argtype, type.restype) )
+        return False
+        
+    def bind(self, typevar, type):
+        if self.occurs(typevar, type):
+            raise TypeCheckerException('occurs check failed: %s and %s' % (typevar, self.resolve(type)))
+        self.links[typevar] = type
+        if self.levels: self.lower(type, self.levels.get(typevar, 0))
+        
+    def lower(self, type, level):
+        '''Lowers every type variable in _type_ to at most _level_.'''
+        levels, types = self.levels, [type]
+        while types:
+            type = self.find(types.pop())
+            if isinstance(type, TypeVar):
+                if levels.get(type, 0) > level: levels[type] = level
+            elif isinstance(type, FunctionType) and not type.ground:
+                types.extend( (type.argtype, type.restype) )
+        
+    def unify(self, lhs, rhs):
+        '''Unifies _lhs_ with _rhs_, raising TypeCheckerException if they cannot be.'''
+        typeqs = self.Equations([ (lhs, rhs) ])
         while typeqs:
             lhs, rhs = typeqs.pop()
+            lhs, rhs = self.find(lhs), self.find(rhs)
             if lhs == rhs: continue
             
-            # given <`a, `b>, map `b arbitrarily to `a so that the reference
-            # can be followed during substitution
+            # given <`a, `b>, link `b arbitrarily to `a
             if isinstance(lhs, TypeVar) and isinstance(rhs, TypeVar):
-                unifier.update({rhs: lhs})
-            # given <`a, T>, map `a to T
+                self.links[rhs] = lhs
+                if self.levels: self.lower(lhs, self.levels.pop(rhs, 0))
+            # given <`a, T>, link `a to T
             elif isinstance(lhs, TypeVar):
-                unifier.update({lhs: rhs})
-            # given <T, `b>, map `b to T
+                self.bind(lhs, rhs)
+            # given <T, `b>, link `b to T
             elif isinstance(rhs, TypeVar):
-                unifier.update({rhs: lhs})
+                self.bind(rhs, lhs)
             
             # given <A -> B, C -> D>, unify <A, C>, <B, D> 
             elif isinstance(lhs, FunctionType) and isinstance(rhs, FunctionType):
-                typeqs.add( (lhs.argtype, rhs.argtype) )
-                typeqs.add( (lhs.restype, rhs.restype) )
+                typeqs.append( (lhs.restype, rhs.restype) )
+                typeqs.append( (lhs.argtype, rhs.argtype) )
             # given <T1, T2>, raise an error if they aren't the same type
             elif isinstance(lhs, AtomicType) and isinstance(rhs, AtomicType):
-                if lhs != rhs:
-                    raise TypeCheckerException('atomic types %s and %s failed to unify' % (lhs, rhs))
+                raise TypeCheckerException('atomic types %s and %s failed to unify' % (lhs, rhs))
             else:
-                raise TypeCheckerException('failed to unify %s and %s' % (lhs, rhs))
+                raise TypeCheckerException('failed to unify %s and %s' % (self.resolve(lhs), self.resolve(rhs)))
+                
+    def resolve(self, type):
+        '''Returns _type_ with every bound type variable replaced by its binding.'''
+        # post-order over an explicit stack: a function type is rebuilt once
+        # both of its parts have been resolved onto _resolved_
+        resolved, stack = [], [ (type, False) ]
+        while stack:
+            type, expanded = stack.pop()
+            if expanded:
+                restype, argtype = resolved.pop(), resolved.pop()
+                if argtype is not type.argtype or restype is not type.restype:
+                    type = FunctionType(argtype, restype)
+                resolved.append(type)
+                continue
+                
+            type = self.find(type)
+            if isinstance(type, FunctionType) and not type.ground:
+                stack.extend( ((type, True), (type.restype, False), (type.argtype, False)) )
+            else:
+                resolved.append(type)
+        return resolved.pop()
         
-        return unifier
+class Stats(object):
+    '''Counters and phase timings collected while checking terms: unify() calls and
+the equations they process, find() calls and the links they walk, occurs checks,
+and wall time per phase. The environment is never rewritten (bindings live in
+the Unifier), so there is no cost to report for that.'''
+    COUNTERS = ('unify_calls', 'equations', 'find_calls', 'find_steps', 'occurs_checks')
     
     def __init__(self):
-        self.newtypes = imap(lambda e: TypeVar(e), FreshVars('_t'))
-    
-    def check_type(self, term):
-        '''Returns the type of _term_.'''
-        return self._check_type(term, {}, {}, set())
-    
-    def _check_type(self, term, env, substs, typeqs):
-        if isinstance(term, Primitive):
-            return term.type()
-        elif isinstance(term, Lambda):
-            # TODO: need to avoid variable capture?
-            env[term.var.name.typename] = term.var.type
-            bodytype = self._check_type(term.body, env, substs, typeqs)
-            return FunctionType(term.var.type, bodytype).apply(substs)
-        elif isinstance(term, Var):
-            vartype = env.get(term.name, None)
-            if not vartype:
-                raise TypeCheckerException('%s not bound in environment' % term.name)
-            
-            # term.type is None => use the type from the declaration of the variable
-            if term.type is None: term.type = vartype
-            
-            return vartype
-        elif isinstance(term, Apply):
-            # (f x) f :: T1 -> T2, x :: X
-            argtype = self._check_type(term.arg, env, substs, typeqs)  # X
-            funtype = self._check_type(term.fn,  env, substs, typeqs)  # T1 -> T2
-            newtype = self.newtypes.next()
-            
-            if isinstance(funtype, AtomicType):
-                raise TypeCheckerException('term of type %s not usable in funcall position' % funtype)
-            
-            # unify T1 -> T2 with X -> t and return t
-            typeqs.add( (funtype, FunctionType(argtype, newtype)) )
+        for counter in self.COUNTERS:
+            setattr(self, counter, 0)
+        self.longest_chain = 0
+        self.timers = defaultdict(float)
+        
+    @contextmanager
+    def timed(self, phase):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.timers[phase] += time.time() - start
             
-            substs.update(self.unify(typeqs))
-            # update env to reflect unification
-            for var in env:
-                env[var] = env[var].apply(substs)
+    def merge(self, other):
+        '''Adds the counts and timings of _other_ to these.'''
+        for counter in self.COUNTERS:
+            setattr(self, counter, getattr(self, counter) + getattr(other, counter))
+        self.longest_chain = max(self.longest_chain, other.longest_chain)
+        for phase, t in other.timers.iteritems():
+            self.timers[phase] += t
             
-            # return t with the unifier applied
-            return newtype.apply(substs)
+    def report(self):
+        lines = [ '%-16s %d' % (counter, getattr(self, counter)) for counter in self.COUNTERS ]
+        lines.append('%-16s %d' % ('longest_chain', self.longest_chain))
+        lines.extend( '%-16s %.6fs' % (phase, self.timers[phase])
+                      for phase in ('lex', 'parse', 'infer') if phase in self.timers )
+        return '\n'.join(lines)
+        
+class CountedEquations(list):
+    def __init__(self, typeqs, stats):
+        list.__init__(self, typeqs)
+        self.stats = stats
+    def pop(self):
+        self.stats.equations += 1
+        return list.pop(self)
+        
+class ProfilingUnifier(Unifier):
+    '''A Unifier which counts its work into _stats_. It is only used when profiling,
+so Unifier itself pays nothing for the counting.'''
+    def __init__(self, stats):
+        Unifier.__init__(self)
+        self.stats = stats
         
-        raise TypeCheckerException('failed to check type: received %s as term' % term)
+    def Equations(self, typeqs):
+        return CountedEquations(typeqs, self.stats)
+        
+    def find(self, type):
+        steps, root = 0, type
+        while isinstance(root, TypeVar) and root in self.links:
+            steps, root = steps + 1, self.links[root]
+        self.stats.find_calls += 1
+        self.stats.find_steps += steps
+        self.stats.longest_chain = max(self.stats.longest_chain, steps)
+        return Unifier.find(self, type)
+        
+    def occurs(self, typevar, type):
+        self.stats.occurs_checks += 1
+        return Unifier.occurs(self, typevar, type)
+        
+    def unify(self, lhs, rhs):
+        self.stats.unify_calls += 1
+        Unifier.unify(self, lhs, rhs)
+        
+class HMTypeChecker(object):
+    def unify(self, typeqs):
+        '''Computes the most general unifier for _typeqs_, a set of type equations.'''
+        unifier = Unifier()
+        for lhs, rhs in typeqs:
+            unifier.unify(lhs, rhs)
+        return dict( (typevar, unifier.resolve(typevar)) for typevar in unifier.links )
+    
+    def __init__(self):
+        self.newtypes = imap(lambda e: TypeVar(e), FreshVars('_t'))
+    
+    def check_type(self, term, stats=None):
+        '''Returns the type of _term_. If a Stats is given as _stats_, the work done
+and the time taken are added to it.'''
+        if stats is None:
+            unifier = Unifier()
+            return unifier.resolve(self._check_type(term, {}, unifier))
+        
+        with stats.timed('infer'):
+            unifier = ProfilingUnifier(stats)
+            return unifier.resolve(self._check_type(term, {}, unifier))
+    
+    def fresh(self, unifier, depth):
+        '''Returns a new type variable introduced at let depth _depth_.'''
+        newtype = self.newtypes.next()
+        if depth: unifier.levels[newtype] = depth
+        return newtype
+    
+    def _check_type(self, term, env, unifier):
+        # types are returned unresolved; bindings live in _unifier_ and are
+        # only substituted once, by check_type.
+        # Terms are visited in the order the recursive definition would visit
+        # them: a Lambda, Apply or Let is pushed back as _visited_ beneath its
+        # children, and combines their types from _types_ when it comes up again.
+        # _depth_ counts the let values a term is inside.
+        types, stack = [], [ (term, False, 0) ]
+        while stack:
+            term, visited, depth = stack.pop()
+            if isinstance(term, Primitive):
+                types.append(term.type())
+            elif isinstance(term, Lambda):
+                if visited:
+                    types.append(FunctionType(term.var.type, types.pop()))
+                else:
+                    # TODO: need to avoid variable capture?
+                    if not isinstance(term.var.name, AtomicType):
+                        raise TypeCheckerException('%s cannot be bound by a lambda' % (term.var.name,))
+                    env[term.var.name.typename] = term.var.type
+                    levels = unifier.levels
+                    for var in type_vars(term.var.type):
+                        if var not in unifier.links and levels.get(var, depth) >= depth:
+                            levels[var] = depth
+                    stack.extend( ((term, True, depth), (term.body, False, depth)) )
+            elif isinstance(term, Var):
+                vartype = env.get(term.name, None)
+                if not vartype:
+                    raise TypeCheckerException('%s not bound in environment' % term.name)
+                if isinstance(vartype, Scheme):
+                    vartype = vartype.instantiate(self.fresh(unifier, depth) for _ in count())
+                
+                # term.type is None => use the type from the declaration of the variable
+                if term.type is None: term.type = vartype
+                
+                types.append(vartype)
+            elif isinstance(term, Apply):
+                if not visited:
+                    stack.extend( ((term, True, depth), (term.fn, False, depth), (term.arg, False, depth)) )
+                    continue
+                    
+                # (f x) f :: T1 -> T2, x :: X
+                funtype, argtype = types.pop(), types.pop()
+                newtype = self.fresh(unifier, depth)
+                
+                if isinstance(unifier.find(funtype), AtomicType):
+                    raise TypeCheckerException('term of type %s not usable in funcall position' % unifier.find(funtype))
+                
+                # unify T1 -> T2 with X -> t and return t
+                unifier.unify(funtype, FunctionType(argtype, newtype))
+                types.append(newtype)
+            elif isinstance(term, Let):
+                if not visited:
+                    stack.extend( ((term, 'value', depth), (term.value, False, depth + 1)) )
+                elif visited == 'value':
+                    # generalise over the variables introduced in the value which
+                    # were not unified with anything outside it
+                    valuetype = unifier.resolve(types.pop())
+                    # the binding is only visible in the body, so keep whatever it shadows
+                    shadowed = env.get(term.name)
+                    env[term.name] = Scheme(
+                        [ var for var in type_vars(valuetype) if unifier.levels.get(var, 0) > depth ],
+                        valuetype)
+                    stack.extend( ((term, ('body', shadowed), depth), (term.body, False, depth)) )
+                else:
+                    # the type of the body is the type of the let
+                    shadowed = visited[1]
+                    if shadowed is None: del env[term.name]
+                    else: env[term.name] = shadowed
+            else:
+                raise TypeCheckerException('failed to check type: received %s as term' % term)
+        return types.pop()
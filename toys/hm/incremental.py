@@ -0,0 +1,271 @@
+'''Incremental type checking. Each Lambda and Apply is typed on its own, as a
+typing: its type, the type it needs each of its free variables to have, and the
+types it gives the type variables in its lambda annotations. Typings are cached by the
+structure of the subterm, so after an edit only the subterms on the path from the
+edit to the root are inferred again; every other subterm is a cache hit.
+
+Variables are scoped lexically, and the type variables of a result are renamed
+in order of appearance (annotation variables keep their names), so the result of
+checking a term does not depend on what the cache holds. Unbound variables are
+reported before any other error.
+
+A typing fixes one type for each free variable, which is not enough for a
+variable bound by a let, so terms containing a Let are checked in full by
+HMTypeChecker.
+
+>>> from fastparse import FastParser
+>>> term = FastParser().parse('\\\\f -> \\\\x -> ((f x) (\\\\y -> y 1))')
+>>> t = IncrementalTypeChecker()
+>>> t.check_type(term)
+(`_v1 -> int -> `_t0) -> `_v1 -> `_t0
+>>> term = edit(term, ['body', 'body', 'arg', 'arg'], Real(.5))
+>>> t.check_type(term)
+(`_v1 -> real -> `_t0) -> `_v1 -> `_t0
+>>> t.hits, t.misses
+(2, 10)
+>>> t.check_type(edit(term, ['body', 'body', 'fn'], Integer(1)))
+Traceback (most recent call last):
+    ...
+TypeCheckerException: term of type int not usable in funcall position
+>>> t.check_type(Lambda(Var(AtomicType('x'), TypeVar('a')), Var('y')))
+Traceback (most recent call last):
+    ...
+TypeCheckerException: y not bound in environment
+>>> t.check_type(FastParser().parse('let id = \\\\x -> x in ((id id) 1)'))
+int
+>>> t.check_type(FastParser().parse('\\\\f -> (\\\\g -> (f 1) let f = .5 in f)'))
+(int -> `_t0) -> `_t0
+>>> f = Lambda(Var(AtomicType('y'), TypeVar('a')), Var('y'))
+>>> t.check_type(Lambda(Var(AtomicType('x'), TypeVar('a')), Let('f', f, Apply(Var('f'), Integer(1)))))
+int -> int
+>>> t.check_type(Lambda(Var(AtomicType('x'), TypeVar('a')), Let('f', f,
+...     Apply(Lambda(Var(AtomicType('z'), TypeVar('b')), Apply(Var('f'), Integer(1))), Apply(Var('f'), Real(.5))))))
+Traceback (most recent call last):
+    ...
+TypeCheckerException: atomic types real and int failed to unify
+'''
+from collections import OrderedDict
+from itertools import imap, count
+
+from hm import *
+
+# structural keys of lambdas and applications are interned as ints drawn from one
+# counter and never reused, so that an int cached on a term names the same
+# structure in every checker, even after a checker has forgotten it
+KEY_IDS = count()
+
+class Fresh(dict):
+    '''A mapping which sends each type variable to a new one, consistently.'''
+    def __init__(self, newvars):
+        self.newvars = newvars
+    def __missing__(self, typevar):
+        self[typevar] = fresh = self.newvars.next()
+        return fresh
+
+def edit(term, path, subterm):
+    '''Returns _term_ with the subterm reached by following the attributes in _path_
+replaced by _subterm_. Only the nodes along _path_ are copied, so the rest of the
+term (and the keys cached on it) is shared with _term_.'''
+    spine = [term]
+    for attr in path:
+        spine.append(getattr(spine[-1], attr))
+    for node, attr in reversed(zip(spine, path)):
+        if isinstance(node, Lambda):
+            node = Lambda(node.var, node.body)
+        else:
+            node = Apply(node.fn, node.arg)
+        setattr(node, attr, subterm)
+        subterm = node
+    return subterm
+
+class HasLet(Exception): pass
+
+class IncrementalTypeChecker(object):
+    '''Checks terms like HMTypeChecker, caching the typings of up to _capacity_
+subterms, and the ints interned for up to _key_capacity_ structural keys (by
+default four times _capacity_). Both are evicted least recently used first, so
+memory stays bounded however long a session runs. Terms are treated as
+immutable: build edited terms with edit().'''
+    def __init__(self, capacity=4096, key_capacity=None):
+        self.capacity = capacity
+        self.typings = OrderedDict()
+        self.key_capacity = key_capacity or 4 * capacity
+        self.keys = OrderedDict()
+        self.newvars = imap(lambda e: TypeVar(e), FreshVars('_i'))
+        self.hits = self.misses = self.evictions = 0
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return float(self.hits) / lookups if lookups else 0.
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses, evictions=self.evictions,
+                    size=len(self.typings), keys=len(self.keys), hit_rate=self.hit_rate())
+        
+    def intern(self, key):
+        '''Returns the int for the structural key _key_. A key which has been evicted
+gets a new int, so terms built since only miss typings cached under the old one.'''
+        id = self.keys.pop(key, None)
+        if id is None: id = KEY_IDS.next()
+        # move to the most recently used end
+        self.keys[key] = id
+        if len(self.keys) > self.key_capacity:
+            self.keys.popitem(last=False)
+        return id
+
+    def check_type(self, term):
+        '''Returns the type of _term_.'''
+        try:
+            self.key(term)
+        except HasLet:
+            return HMTypeChecker().check_type(term)
+        if term._free:
+            raise TypeCheckerException('%s not bound in environment' % term._free[0])
+        # the cached typing may come from a subterm with other annotation names
+        unifier = Unifier()
+        type, _ = self.instantiate(unifier, term, self.typing(term))
+        type = unifier.resolve(type)
+
+        names = [ TypeVar(name) for name in term._annots ]
+        mapping = Fresh(imap(lambda e: TypeVar(e), FreshVars('_t')))
+        mapping.update( (var, var) for var in names )
+        for var in type_vars(type): mapping[var]
+        return substitute(type, mapping)
+
+    def key(self, term):
+        '''Caches on each node of _term_ its structural key, the names of the type
+variables in its lambda annotations in order of appearance, and the names of its
+free variables in the order HMTypeChecker would meet them. Nodes which already
+carry a key are not visited again.'''
+        stack = [ (term, False) ]
+        while stack:
+            term, visited = stack.pop()
+            if hasattr(term, '_key'): continue
+            if isinstance(term, Lambda):
+                if not visited:
+                    stack.extend( ((term, True), (term.body, False)) )
+                    continue
+                if not isinstance(term.var.name, AtomicType):
+                    raise TypeCheckerException('%s cannot be bound by a lambda' % (term.var.name,))
+                own = [ var.typevarname for var in type_vars(term.var.type) ]
+                annots = own + [ name for name in term.body._annots if name not in own ]
+                canonical = dict( (TypeVar(name), TypeVar('_k%d' % i)) for i, name in enumerate(own) )
+                key = ('lambda', term.var.name.typename, substitute(term.var.type, canonical),
+                       term.body._key, tuple(imap(annots.index, term.body._annots)))
+                free = [ name for name in term.body._free if name != term.var.name.typename ]
+            elif isinstance(term, Apply):
+                if not visited:
+                    stack.extend( ((term, True), (term.fn, False), (term.arg, False)) )
+                    continue
+                annots = term.fn._annots + tuple(
+                    name for name in term.arg._annots if name not in term.fn._annots)
+                key = ('apply', term.fn._key, term.arg._key,
+                       tuple(imap(annots.index, term.arg._annots)))
+                # the argument is checked first
+                free = term.arg._free + tuple(
+                    name for name in term.fn._free if name not in term.arg._free)
+            # leaves are their own keys, and are never cached
+            elif isinstance(term, Var):
+                term._key, term._annots, term._free = ('var', term.name), (), (term.name,)
+                continue
+            elif isinstance(term, Primitive):
+                term._key, term._annots, term._free = ('primitive', term.type()), (), ()
+                continue
+            elif isinstance(term, Let):
+                raise HasLet()
+            else:
+                raise TypeCheckerException('failed to check type: received %s as term' % term)
+            term._key, term._annots, term._free = self.intern(key), tuple(annots), tuple(free)
+
+    def typing(self, term):
+        '''Returns the typing (type, free, annots) of _term_: _free_ maps each free
+variable to its type, and _annots_ holds the types of the variables in
+term._annots.'''
+        typings, stack = [], [ (term, False) ]
+        while stack:
+            term, visited = stack.pop()
+            if isinstance(term, Var):
+                type = self.newvars.next()
+                typings.append( (type, {term.name: type}, []) )
+                continue
+            elif isinstance(term, Primitive):
+                typings.append( (term.type(), {}, []) )
+                continue
+
+            typing = self.typings.get(term._key)
+            if not visited:
+                if typing is not None:
+                    self.hits += 1
+                    # move to the most recently used end
+                    del self.typings[term._key]
+                    self.typings[term._key] = typing
+                    if isinstance(typing, TypeCheckerException): raise typing
+                    typings.append(typing)
+                    continue
+                self.misses += 1
+                if isinstance(term, Lambda):
+                    stack.extend( ((term, True), (term.body, False)) )
+                else:
+                    stack.extend( ((term, True), (term.fn, False), (term.arg, False)) )
+                continue
+
+            try:
+                if isinstance(term, Lambda):
+                    typing = self.infer_lambda(term, typings.pop())
+                else:
+                    fn = typings.pop()
+                    typing = self.infer_apply(term, fn, typings.pop())
+            except TypeCheckerException, e:
+                typing = e
+            self.typings[term._key] = typing
+            if len(self.typings) > self.capacity:
+                self.typings.popitem(last=False)
+                self.evictions += 1
+            if isinstance(typing, TypeCheckerException): raise typing
+            typings.append(typing)
+
+        return typings.pop()
+
+    def instantiate(self, unifier, child, typing):
+        '''Copies the typing of the subterm _child_ into _unifier_ with fresh type
+variables, tying its annotation variables to the ones named in _child_.'''
+        type, free, annots = typing
+        mapping = Fresh(self.newvars)
+        for name, annot in zip(child._annots, annots):
+            unifier.unify(TypeVar(name), substitute(annot, mapping))
+        return (substitute(type, mapping),
+                dict( (name, substitute(t, mapping)) for (name, t) in free.iteritems() ))
+
+    def export(self, unifier, term, type, free):
+        return (unifier.resolve(type),
+                dict( (name, unifier.resolve(t)) for (name, t) in free.iteritems() ),
+                [ unifier.resolve(TypeVar(name)) for name in term._annots ])
+
+    def infer_lambda(self, term, body):
+        unifier = Unifier()
+        bodytype, free = self.instantiate(unifier, term.body, body)
+        if term.var.name.typename in free:
+            unifier.unify(term.var.type, free.pop(term.var.name.typename))
+        return self.export(unifier, term, FunctionType(term.var.type, bodytype), free)
+
+    def infer_apply(self, term, fn, arg):
+        unifier = Unifier()
+        # (f x) f :: T1 -> T2, x :: X
+        argtype, free = self.instantiate(unifier, term.arg, arg)
+        funtype, fnfree = self.instantiate(unifier, term.fn, fn)
+        # a variable free in both is bound by the same lambda, so has one type
+        for name, type in fnfree.iteritems():
+            if name in free: unifier.unify(free[name], type)
+            else: free[name] = type
+        newtype = self.newvars.next()
+
+        if isinstance(unifier.find(funtype), AtomicType):
+            raise TypeCheckerException('term of type %s not usable in funcall position' % unifier.find(funtype))
+
+        # unify T1 -> T2 with X -> t and return t
+        unifier.unify(funtype, FunctionType(argtype, newtype))
+        return self.export(unifier, term, newtype, free)
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -1,5 +1,5 @@
 # grammar:
-# term ::= ( term term ) | LAMBDA vardef . term | value | varname
+# term ::= ( term term ) | LAMBDA vardef . term | LET varname = term IN term | value | varname
 # vardef ::= varname : type
 # type ::= atomictype | type -> type | typevar
 # typevar ::= BACKTICK typename
@@ -36,6 +36,12 @@ def p_term(stk):
     elif len(stk) == 2:
         stk[0] = stk[1]
         
+def p_let(stk):
+    '''
+    term : LET NAME EQUALS term IN term
+    '''
+    stk[0] = Let(stk[2], stk[4], stk[6])
+        
 def p_var(stk):
     '''
     var : NAME
@@ -94,8 +100,7 @@ def p_type(stk):
     elif len(stk) == 2:
         stk[0] = stk[1]
     
-from itertools import imap, count
-freshvars = imap(lambda e: TypeVar('_v'+str(e)), count(0))
+from itertools import imap, count, islice
 def p_vardef(stk):
     '''
     vardef : varname COLON type
@@ -104,13 +109,16 @@ def p_vardef(stk):
     if len(stk) == 4:
         stk[0] = Var(stk[1], stk[3])
     elif len(stk) == 2:
-        global freshvars
-        stk[0] = Var(stk[1], freshvars.next())
+        # fresh variables come from the Parser driving this parse
+        stk[0] = Var(stk[1], stk.parser.freshvars.next())
 
-tokens = ('INT', 'REAL', 'LAMBDA', 'LPA', 'RPA', 'COLON', 'ARROW', 'BACKTICK', 'NAME')
+reserved = { 'let': 'LET', 'in': 'IN' }
+tokens = ('INT', 'REAL', 'LAMBDA', 'LPA', 'RPA', 'COLON', 'ARROW', 'BACKTICK', 'EQUALS', 'NAME') + \
+    tuple(reserved.values())
 
 def t_NAME(t):
     r'[a-zA-Z][a-zA-Z0-9]*'
+    t.type = reserved.get(t.value, 'NAME')
     return t
 
 def t_INT(t):
@@ -145,6 +153,10 @@ def t_BACKTICK(t):
     r"[`']"
     return t
     
+def t_EQUALS(t):
+    r'='
+    return t
+    
 t_ignore = ' \t\r\v\f\n'
 
 def t_error(t):
@@ -154,17 +166,127 @@ def t_error(t):
 def p_error(stk):
     err("Syntax error encountered: %s", stk)
     
-def parse(s):
-    lex.lex()
-    yacc.yacc()
+class Parser(object):
+    '''Parses lambda terms. The lexer and LALR tables are built once per Parser (the
+tables are cached in the parsetab module, so later Parsers just load them) and
+reused for every term. Unannotated variables are typed `_v0, `_v1, ... afresh
+within each term, so the result of parsing a term never depends on what was
+parsed before it.'''
+    def __init__(self):
+        self.lexer = lex.lex()
+        self.parser = yacc.yacc(debug=False)
+        
+    def parse(self, s, stats=None):
+        '''Returns the term _s_ parses to. If a Stats is given as _stats_, the input is
+tokenised before parsing begins, so that the two phases can be timed apart.'''
+        self.parser.freshvars = imap(lambda e: TypeVar('_v'+str(e)), count(0))
+        if stats is None:
+            return self.parser.parse(s, lexer=self.lexer)
+            
+        with stats.timed('lex'):
+            self.lexer.input(s)
+            tokens = iter(list(iter(self.lexer.token, None)))
+        with stats.timed('parse'):
+            return self.parser.parse(tokenfunc=lambda: next(tokens, None))
+        
+    def parse_many(self, strings):
+        for s in strings:
+            yield self.parse(s)
     
-    query = yacc.parse(s)
-    return query
+default_parser = None
+def parse(s):
+    global default_parser
+    if default_parser is None:
+        default_parser = Parser()
+    return default_parser.parse(s)
     
-if __name__ == '__main__':
-    term = parse(sys.argv[1])
-    t = HMTypeChecker()
+def check(line, parser=None, stats=None):
+    '''Parses and type checks the term _line_, returning the line of batch output for
+it. Fresh type variables are named afresh for each term, so the result only
+depends on _line_. Profiles into _stats_ if it is given. Any failure is reported
+as an error line, so that one bad term does not stop a batch.'''
+    TypeVar.reset_newvars()
     try:
-        print t.check_type(term)
+        term = (parser or worker_parser or default_parser).parse(line, stats)
+        if term is None:
+            return '%s\terror: syntax error' % line
+        return '%s\t%s' % (line, HMTypeChecker().check_type(term, stats))
     except TypeCheckerException, e:
-        err(e.message)
\ No newline at end of file
+        return '%s\terror: %s' % (line, e.message)
+    except Exception, e:
+        return '%s\terror: %s: %s' % (line, type(e).__name__, e)
+        
+def check_profiled(line):
+    stats = Stats()
+    return check(line, stats=stats), stats
+        
+worker_parser = None
+def init_worker(parser_class):
+    global worker_parser
+    worker_parser = parser_class()
+    
+def check_batch(lines, processes=1, parser_class=Parser, window=1024, stats=None):
+    '''Yields the batch output for each term in _lines_, in order, checking them across
+_processes_ worker processes. At most _window_ terms are read ahead of the output.
+The profiles of every term are merged into _stats_ if it is given.'''
+    global default_parser
+    # build (and cache) the tables before the workers load them
+    default_parser = parser_class()
+    lines = ( line.strip() for line in lines )
+    lines = ( line for line in lines if line )
+    if processes == 1:
+        for line in lines:
+            yield check(line, stats=stats)
+        return
+    
+    from multiprocessing import Pool
+    pool = Pool(processes, init_worker, (parser_class,))
+    try:
+        chunksize = max(1, window // (4 * processes))
+        while True:
+            batch = list(islice(lines, window))
+            if not batch: break
+            if stats is None:
+                for result in pool.imap(check, batch, chunksize):
+                    yield result
+                continue
+            for result, term_stats in pool.imap(check_profiled, batch, chunksize):
+                stats.merge(term_stats)
+                yield result
+    finally:
+        pool.terminate()
+    
+if __name__ == '__main__':
+    import argparse
+    argparser = argparse.ArgumentParser(description='Type checks lambda terms.')
+    argparser.add_argument('term', nargs='?', help='a term to type check')
+    argparser.add_argument('--batch', metavar='FILE',
+                           help='type check the terms on each line of FILE (- for stdin)')
+    argparser.add_argument('-j', '--processes', type=int, default=1)
+    argparser.add_argument('--fast', action='store_true', help='use the hand-written parser')
+    argparser.add_argument('--profile', action='store_true',
+                           help='report the work done and the time spent in each phase')
+    args = argparser.parse_args()
+    stats = Stats() if args.profile else None
+    
+    parser_class = Parser
+    if args.fast:
+        from fastparse import FastParser as parser_class
+        
+    if args.batch:
+        f = sys.stdin if args.batch == '-' else open(args.batch)
+        for result in check_batch(f, args.processes, parser_class, stats=stats):
+            print result
+            sys.stdout.flush()
+    elif args.term:
+        term = parser_class().parse(args.term, stats)
+        t = HMTypeChecker()
+        try:
+            print t.check_type(term, stats)
+        except TypeCheckerException, e:
+            err(e.message)
+    else:
+        argparser.error('give a term or --batch')
+        
+    if stats is not None:
+        print >>sys.stderr, stats.report()
@@ -0,0 +1,113 @@
+'''Benchmarks the phases of OSTIA on training sets sampled from random subsequential
+functions, reporting throughput and memory for each phase. --json stores the
+results for comparison.
+
+    python bench.py --pairs 1000 2000 4000 --states 8 --alphabet 3 --json ostia.json
+    python bench.py --check 2
+
+--check P instead learns a corpus over a large alphabet serially and with P
+processes on each backend, and checks that the results are identical.
+
+On the defaults, red_blue gets faster per pair as the corpus grows, since the
+learned transducer closes in on the target and merges are found sooner: 190
+pairs/s for 5000 pairs (526 states learned), 2635 for 100000 (152 states) and
+4384 for 200000 (61 states), the whole of ostia taking 47s for 100000 pairs.
+
+    python bench.py --pairs 5000 20000 50000 100000 200000
+'''
+import sys
+import time
+import json
+import random
+import argparse
+from itertools import product
+
+from ostia import *
+
+class SubsequentialFunction(object):
+    '''A random total subsequential transducer with _n_states_ states over an input
+alphabet of _alphabet_size_ symbols, emitting up to _max_output_ symbols from an
+output alphabet of _output_size_ symbols on each transition and at each state.'''
+    def __init__(self, n_states, alphabet_size, output_size=2, max_output=2, seed=0):
+        r = random.Random(seed)
+        self.alphabet = [ 'a%d' % i for i in xrange(alphabet_size) ]
+        outputs = [ 'b%d' % i for i in xrange(output_size) ]
+        def output():
+            return tuple(r.choice(outputs) for _ in xrange(r.randint(0, max_output)))
+            
+        self.delta = dict( ((state, symbol), (r.randrange(n_states), output()))
+                           for (state, symbol) in product(xrange(n_states), self.alphabet) )
+        self.final = [ output() for _ in xrange(n_states) ]
+        
+    def __call__(self, input):
+        state, result = 0, ()
+        for symbol in input:
+            state, output = self.delta[state, symbol]
+            result += output
+        return result + self.final[state]
+        
+    def sample(self, n_pairs, max_length, seed=0):
+        '''Returns _n_pairs_ distinct training pairs with inputs of length up to _max_length_.'''
+        r = random.Random(seed)
+        inputs = set()
+        while len(inputs) < n_pairs:
+            inputs.add(tuple(r.choice(self.alphabet) for _ in xrange(r.randint(0, max_length))))
+        return [ (input, self(input)) for input in sorted(inputs) ]
+        
+def check_processes(processes, n_states=3, alphabet_size=12, n_pairs=300, max_length=5, seed=1):
+    '''Learns a corpus serially and with _processes_ processes on each backend,
+printing whether the two transducers are identical. The alphabet is large so
+that states have many edges, whose order the replicas must agree on. A
+Transducer is learned as an OrderedTransducer when speculating, so that is what
+it is compared with. Returns the number of backends on which they differ.'''
+    data = SubsequentialFunction(n_states, alphabet_size, seed=seed).sample(n_pairs, max_length, seed=seed)
+    differ = 0
+    for backend, serial_backend in ((Transducer, OrderedTransducer), (CompactTransducer, CompactTransducer)):
+        serial = ostia(data, serial_backend).as_graph()
+        parallel = ostia(data, backend, processes=processes).as_graph()
+        differ += serial != parallel
+        print '%-18s %d processes: %s' % (backend.__name__, processes,
+                                          'identical' if serial == parallel else 'DIFFERENT')
+    return differ
+        
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks the phases of OSTIA.')
+    parser.add_argument('--pairs', type=int, nargs='+', default=[500, 1000, 2000])
+    parser.add_argument('--states', type=int, default=6)
+    parser.add_argument('--alphabet', type=int, default=3)
+    parser.add_argument('--max-length', type=int, default=12)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--backend', choices=['Transducer', 'CompactTransducer'], default='CompactTransducer')
+    parser.add_argument('--order', choices=sorted(BLUE_ORDERS), default='fifo')
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--json', metavar='FILE', help='also write the results to FILE')
+    parser.add_argument('--check', type=int, metavar='P',
+                        help='check that P processes learn what one does, instead')
+    args = parser.parse_args()
+    if args.check:
+        sys.exit(1 if check_processes(args.check) else 0)
+    results = {}
+    
+    f = SubsequentialFunction(args.states, args.alphabet, seed=args.seed)
+    for n_pairs in args.pairs:
+        data = f.sample(n_pairs, args.max_length, seed=args.seed)
+        start = time.time()
+        with Metrics() as metrics:
+            T = ostia(data, globals()[args.backend], args.order, args.processes)
+        metrics.timers['ostia'] = time.time() - start
+        C = T.compile()
+        
+        print '%d pairs: %d learned states' % (n_pairs, len(C.final_output) - 1)
+        for phase in ('ptt', 'make_onward', 'red_blue', 'ostia'):
+            t = metrics.timers[phase]
+            rate = n_pairs / t if t else float('inf')
+            results['%s.%d' % (phase, n_pairs)] = dict(
+                seconds=t, count=n_pairs, unit='pairs', rate=rate, memory=metrics.memory[phase])
+            print '  %-12s %9.3fs %12.0f pairs/s %8d KB' % (phase, t, rate, metrics.memory[phase])
+        for name in sorted(metrics.counters):
+            print '  %-20s %d' % (name, metrics.counters[name])
+        print '  %-20s %d' % ('fold.depth (max)', metrics.maxima['fold.depth'])
+        
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(dict(parameters=vars(args), results=results), f, indent=1, sort_keys=True)
@@ -12,15 +12,40 @@ True
 True
 >>> P in t.outgoing_states_from(Q)
 False
+>>> t.begin()
+>>> t.set_edge_output_string(P, "abc", "456")
+>>> t.set_state_output(Q, "0")
+>>> t.rollback()
+>>> t.edge_output_string(P, "abc"), Q.output
+('123', '512')
 '''
 
-def debug(s, *args):
+def trace(s, *args):
     print >>sys.stderr, s % args
+def debug(s, *args):
+    pass
+def set_verbose(verbose):
+    '''Turns tracing of the OSTIA internals to stderr on or off. It is off by default,
+since the messages are formatted from whole transducers in the hottest loops.'''
+    global debug
+    debug = trace if verbose else (lambda s, *args: None)
 
 import sys
 import copy
-from itertools import chain, islice, izip
-from collections import defaultdict
+import time
+import resource
+import mmap
+import struct
+from itertools import chain, islice, izip, count, imap
+from heapq import heappush, heappop
+from multiprocessing import Process, Pipe
+from collections import defaultdict, OrderedDict
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 class ddict(defaultdict):
     def __repr__(self):
@@ -51,7 +76,10 @@ class State(object):
         
 import pdb
 LAMBDA = ()
-class Transducer(object):
+class TransducerBase(object):
+    '''Behaviour shared by every transducer backend: the undo journal and DOT output.
+Backends identify states by whatever handle they like; algorithms only ever go
+through the accessors below.'''
     def as_graph(self):
         def can(output):
             try:
@@ -60,15 +88,15 @@ class Transducer(object):
             except:
                 pdb.post_mortem()
         states = '\n'.join(r'"s%(state)s" [label="%(state)s:%(output)s"]' % {
-            'state': can(state.label),
-            'output': can(state.output),
-        } for state in self.states.values())
+            'state': can(self.state_label(state)),
+            'output': can(self.state_output(state)),
+        } for state in self.each_state())
 
         edges = '\n'.join(r'"s%(src)s" -> "s%(dst)s" [label="%(edge)s"]' % {
-            'src': can(state.label),
-            'dst': can(target.label),
+            'src': can(self.state_label(state)),
+            'dst': can(self.state_label(target)),
             'edge': '%s:%s' % (input, can(output))
-        } for state in self.states.values()
+        } for state in self.each_state()
           for (input, output, target) in self.outgoing_edges_from(state))
         
         return '''
@@ -78,11 +106,40 @@ digraph G {
 }
 ''' % locals()
 
+    def begin(self):
+        '''Starts recording every mutation so that it can be undone by rollback().'''
+        self.journal = []
+    def commit(self):
+        '''Keeps every mutation made since begin().'''
+        self.journal = None
+    def rollback(self):
+        '''Undoes every mutation made since begin(), most recent first.'''
+        journal, self.journal = self.journal, None
+        for undo, args in reversed(journal):
+            undo(*args)
+            
+    def _record(self, undo, *args):
+        if self.journal is not None:
+            self.journal.append( (undo, args) )
+            
+    def compile(self):
+        '''Freezes the states reachable from the initial state into a CompiledTransducer.'''
+        return CompiledTransducer.from_transducer(self)
+
+class Transducer(TransducerBase):
     # { state: { input: [output, state] } }
     def __init__(self):
-        self.T = defaultdict(lambda: defaultdict(lambda: [None, None]))
+        self.T = defaultdict(self.Edges)
         self.incoming = defaultdict(set)
         self.states = {}
+        # list of (undo function, args) while a merge is in progress, else None
+        self.journal = None
+        
+    def _add_incoming(self, target, source, input):
+        if (source, input) not in self.incoming[target]:
+            self.incoming[target].add( (source, input) )
+            return True
+        return False
         
     def incoming_states_to(self, target):
         for (state, input) in self.incoming[target]:
@@ -97,23 +154,66 @@ digraph G {
         
     def add_state(self, state_label, output=BOT):
         self.states[state_label] = State(state_label, output)
+        self._record(self.remove_state, state_label)
+    def add_child(self, source, input, label):
+        '''Adds a new state _label_, reached from _source_ on _input_ with an empty output.'''
+        self.add_state(label)
+        target = self.states[label]
+        self.add_transition(source, input, LAMBDA, target)
+        return target
+        
+    def state_label(self, state):
+        return state.label
+    def state_output(self, state):
+        return state.output
+    def set_state_output(self, state, output):
+        self._record(self._undo_state_output, state, state.output)
+        state.output = output
+    def _undo_state_output(self, state, output):
+        state.output = output
         
     def add_transition(self, source, input, output, target):
+        old_edge = self.T[source].get(input, None)
         self.T[source][input] = [output, target]
         
-        self.incoming[target].add( (source, input) )
+        added = self._add_incoming(target, source, input)
+        self._record(self._undo_transition, source, input, old_edge, target, added)
+    def _undo_transition(self, source, input, old_edge, target, added):
+        if old_edge is None:
+            del self.T[source][input]
+        else:
+            self.T[source][input] = old_edge
+        if added:
+            self.incoming[target].discard( (source, input) )
         
     def edge_output_string(self, source, input):
         return self.T[source][input][0]
     def set_edge_output_string(self, source, input, output):
-        self.T[source][input][0] = output
+        edge = self.T[source][input]
+        self._record(self._undo_edge_output_string, edge, edge[0])
+        edge[0] = output
+    def _undo_edge_output_string(self, edge, output):
+        edge[0] = output
         
     def edge_target_state(self, source, input):
         return self.T[source][input][1]
+    def transition_target(self, source, input):
+        '''Returns the state _source_ goes to on _input_, or None if there is no such edge.'''
+        edges = self.T.get(source)
+        if edges is None or input not in edges:
+            return None
+        return edges[input][1]
     def set_edge_target_state(self, source, input, target):    
-        self.T[source][input][1] = target
+        edge = self.T[source][input]
+        old_target = edge[1]
+        edge[1] = target
         
-        self.incoming[target].add( (source, input) )
+        added = self._add_incoming(target, source, input)
+        self._record(self._undo_edge_target_state, edge, old_target, target, source, input, added)
+    def _undo_edge_target_state(self, edge, old_target, target, source, input, added):
+        edge[1] = old_target
+        if added:
+            self.incoming[target].discard( (source, input) )
         
     def outgoing_states_from(self, source):
         for (input, (output, target)) in self.T[source].items():
@@ -126,10 +226,533 @@ digraph G {
     def all_states(self):
         for state in self.states:
             yield state
+    def each_state(self):
+        return self.states.itervalues()
             
     def __repr__(self):
         return '<Transducer %s>' % self.T
+        
+    @staticmethod
+    def Edges():
+        return defaultdict(lambda: [None, None])
+        
+class OrderedEdges(OrderedDict):
+    '''The edges out of one state, { input: [output, state] }, in the order they
+were added. Rollback removes the newest edges first, so it restores this order
+exactly.'''
+    def __missing__(self, input):
+        self[input] = edge = [None, None]
+        return edge
+        
+class OrderedTransducer(Transducer):
+    '''A Transducer whose edges out of each state are visited in the order they
+were added, so the order red_blue and fold visit them in depends only on the
+merges kept, not on the ones rolled back. SpeculativeMerges relies on this to keep
+its replicas in step; OrderedDict is pure Python, so other uses are better off
+with a Transducer.'''
+    Edges = OrderedEdges
+    
+NO_EDGE = -1
+class CompactTransducer(TransducerBase):
+    '''A Transducer for very large prefix tree transducers. States are integer ids,
+input symbols and output strings are interned, and every per-state or per-edge
+field lives in a flat array rather than in its own object.
+
+>>> t = CompactTransducer()
+>>> a = t.get_state(('x',))
+>>> b = t.get_state(('x', 'y'))
+>>> t.set_state_output(b, ('1',))
+>>> t.set_edge_output_string(a, 'y', ('0',))
+>>> list(t.outgoing_edges_from(a)) == [('y', ('0',), b)]
+True
+>>> t.state_label(b), t.state_output(b), t.state_output(a)
+(('x', 'y'), ('1',), None)
+>>> t.begin()
+>>> t.add_transition(b, 'x', ('2',), a)
+>>> sorted(t.incoming_states_to(a)) == [(0, 'x'), (b, 'x')]
+True
+>>> t.rollback()
+>>> list(t.outgoing_edges_from(b)), list(t.incoming_states_to(a)) == [(0, 'x')]
+([], True)
+'''
+    def __init__(self):
+        # interned input symbols and output strings; output id -1 stands for BOT
+        self.symbols, self.symbol_ids = [], {}
+        self.output_strings, self.output_ids = [], {}
+        
+        # per state: the state it was created under and on which symbol (so
+        # that labels need not be stored), its output, and the heads of its
+        # outgoing edge list and incoming entry list
+        self.parent = array('i')
+        self.parent_input = array('i')
+        self.output = array('i')
+        self.first_out = array('i')
+        self.first_in = array('i')
+        
+        # per edge: source, input symbol, output string, target and the next
+        # edge out of the same source
+        self.edge_source = array('i')
+        self.edge_input = array('i')
+        self.edge_output = array('i')
+        self.edge_target = array('i')
+        self.next_out = array('i')
+        # { source << 32 | input symbol id: edge id }
+        self.edges = {}
+        
+        # incoming entries: an edge id and the next entry into the same target
+        self.in_edge = array('i')
+        self.next_in = array('i')
+        
+        self.journal = None
+        self._new_state(NO_EDGE, NO_EDGE)
+        
+    def _intern_symbol(self, symbol):
+        symbol_id = self.symbol_ids.get(symbol)
+        if symbol_id is None:
+            symbol_id = self.symbol_ids[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+        return symbol_id
+        
+    def _intern_output(self, output):
+        if output is BOT: return NO_EDGE
+        output_id = self.output_ids.get(output)
+        if output_id is None:
+            output_id = self.output_ids[output] = len(self.output_strings)
+            self.output_strings.append(output)
+        return output_id
+        
+    def _output_string(self, output_id):
+        if output_id == NO_EDGE: return BOT
+        return self.output_strings[output_id]
+        
+    def _edge(self, source, input):
+        return self.edges[source << 32 | self.symbol_ids[input]]
+        
+    def _new_state(self, parent, parent_input):
+        state = len(self.output)
+        self.parent.append(parent)
+        self.parent_input.append(parent_input)
+        self.output.append(NO_EDGE)
+        self.first_out.append(NO_EDGE)
+        self.first_in.append(NO_EDGE)
+        self._record(self._undo_new_state)
+        return state
+    def _undo_new_state(self):
+        for column in (self.parent, self.parent_input, self.output, self.first_out, self.first_in):
+            column.pop()
+            
+    def _push_incoming(self, target, edge):
+        self.in_edge.append(edge)
+        self.next_in.append(self.first_in[target])
+        self.first_in[target] = len(self.in_edge) - 1
+    def _pop_incoming(self, target):
+        self.first_in[target] = self.next_in.pop()
+        self.in_edge.pop()
+        
+    def get_state(self, state_label):
+        '''Finds the state reached from the initial state by _state_label_, creating
+any states missing along the way. Labels are only meaningful before merging.'''
+        state = 0
+        for input in state_label:
+            target = self.transition_target(state, input)
+            if target is None:
+                target = self.add_child(state, input)
+            state = target
+        return state
+    def add_child(self, source, input, label=None):
+        '''Adds a new state reached from _source_ on _input_. The label is implied.'''
+        target = self._new_state(source, self._intern_symbol(input))
+        self.add_transition(source, input, LAMBDA, target)
+        return target
+        
+    def state_label(self, state):
+        label = []
+        while self.parent[state] != NO_EDGE:
+            label.append(self.symbols[self.parent_input[state]])
+            state = self.parent[state]
+        return tuple(reversed(label))
+    def state_output(self, state):
+        return self._output_string(self.output[state])
+    def set_state_output(self, state, output):
+        self._record(self._undo_state_output, state, self.output[state])
+        self.output[state] = self._intern_output(output)
+    def _undo_state_output(self, state, output_id):
+        self.output[state] = output_id
+        
+    def each_state(self):
+        return iter(xrange(len(self.output)))
+        
+    def incoming_states_to(self, target):
+        entry = self.first_in[target]
+        while entry != NO_EDGE:
+            edge = self.in_edge[entry]
+            # entries are never unlinked when an edge is retargeted away
+            if self.edge_target[edge] == target:
+                yield (self.edge_source[edge], self.symbols[self.edge_input[edge]])
+            entry = self.next_in[entry]
+            
+    def add_transition(self, source, input, output, target):
+        key = source << 32 | self._intern_symbol(input)
+        edge = self.edges.get(key)
+        if edge is not None:
+            self.set_edge_output_string(source, input, output)
+            self.set_edge_target_state(source, input, target)
+            return
+            
+        edge = len(self.edge_source)
+        self.edges[key] = edge
+        self.edge_source.append(source)
+        self.edge_input.append(key & 0xffffffff)
+        self.edge_output.append(self._intern_output(output))
+        self.edge_target.append(target)
+        self.next_out.append(self.first_out[source])
+        self.first_out[source] = edge
+        self._push_incoming(target, edge)
+        self._record(self._undo_transition, key, source, target)
+    def _undo_transition(self, key, source, target):
+        del self.edges[key]
+        self._pop_incoming(target)
+        self.first_out[source] = self.next_out.pop()
+        for column in (self.edge_source, self.edge_input, self.edge_output, self.edge_target):
+            column.pop()
+            
+    def edge_output_string(self, source, input):
+        return self._output_string(self.edge_output[self._edge(source, input)])
+    def set_edge_output_string(self, source, input, output):
+        edge = self._edge(source, input)
+        self._record(self._undo_edge_output_string, edge, self.edge_output[edge])
+        self.edge_output[edge] = self._intern_output(output)
+    def _undo_edge_output_string(self, edge, output_id):
+        self.edge_output[edge] = output_id
+        
+    def edge_target_state(self, source, input):
+        return self.edge_target[self._edge(source, input)]
+    def transition_target(self, source, input):
+        symbol_id = self.symbol_ids.get(input)
+        if symbol_id is None: return None
+        edge = self.edges.get(source << 32 | symbol_id)
+        if edge is None: return None
+        return self.edge_target[edge]
+    def set_edge_target_state(self, source, input, target):
+        edge = self._edge(source, input)
+        self._record(self._undo_edge_target_state, edge, self.edge_target[edge], target)
+        self.edge_target[edge] = target
+        self._push_incoming(target, edge)
+    def _undo_edge_target_state(self, edge, old_target, target):
+        self.edge_target[edge] = old_target
+        self._pop_incoming(target)
+        
+    def outgoing_states_from(self, source):
+        for (input, output, target) in self.outgoing_edges_from(source):
+            yield target
             
+    def outgoing_edges_from(self, source):
+        # snapshot the list so that callers may add transitions while iterating
+        edges = []
+        edge = self.first_out[source]
+        while edge != NO_EDGE:
+            edges.append(edge)
+            edge = self.next_out[edge]
+        for edge in reversed(edges):
+            yield (self.symbols[self.edge_input[edge]],
+                   self._output_string(self.edge_output[edge]),
+                   self.edge_target[edge])
+                   
+    def __repr__(self):
+        return '<CompactTransducer %d states %d edges>' % (len(self.output), len(self.edge_source))
+            
+class CompiledTransducer(object):
+    '''A learned transducer frozen into dense tables for applying it to new inputs.
+State 0 is the initial state and the last state is a sink which every undefined
+transition leads to. For state s and input symbol id a, delta[s * len(symbols) + a]
+is the next state and edge_output[...] the id of the output emitted on the way;
+final_output[s] is the id of the output of s, or -1 for BOT. Output id k is the
+run output_offsets[k]:output_offsets[k+1] of output_buffer, a sequence of ids
+into output_symbols, and output id 0 is always LAMBDA.
+
+>>> T = ostia([(('a',), ('1',)), (('b',), ('2', '2')), (('a', 'a'), ('1', '1')), (('a', 'b'), ('1', '2', '2'))])
+>>> C = T.compile()
+>>> list(C.transduce([('a', 'a', 'b'), ('b', 'b'), ('c',)]))
+[('1', '1', '2', '2'), ('2', '2', '2', '2'), None]
+>>> emitted, final = C.transduce_array([C.encode(('a', 'b')), C.encode(('b', 'c'))])
+>>> [C.output(i) for i in emitted[0]] + [C.output(final[0])], final[1]
+([('1',), ('2', '2'), ()], -1)
+>>> C = ostia([((), ('x',))]).compile()
+>>> list(C.transduce([(), ('a',)]))
+[('x',), None]
+>>> [ C.transduce_array([C.encode(input)])[1][0] for input in [(), ('a',)] ]
+[1, -1]
+'''
+    def __init__(self, symbols, output_symbols, delta, edge_output, final_output,
+                 output_offsets, output_buffer):
+        self.symbols = symbols
+        self.symbol_ids = dict( (symbol, i) for (i, symbol) in enumerate(symbols) )
+        self.output_symbols = output_symbols
+        self.delta = delta
+        self.edge_output = edge_output
+        self.final_output = final_output
+        self.output_offsets = output_offsets
+        self.output_buffer = output_buffer
+        # output strings are only decoded from the buffer when first used
+        self.outputs = [None] * (len(output_offsets) - 1)
+        
+    @staticmethod
+    def from_transducer(T):
+        # number the reachable states breadth first from the initial state
+        states = [ T.get_state(LAMBDA) ]
+        state_ids = { states[0]: 0 }
+        symbol_ids, symbols = {}, []
+        for state in states:
+            for (input, output, target) in T.outgoing_edges_from(state):
+                if target not in state_ids:
+                    state_ids[target] = len(states)
+                    states.append(target)
+                if input not in symbol_ids:
+                    symbol_ids[input] = len(symbols)
+                    symbols.append(input)
+                    
+        output_symbol_ids, output_symbols = {}, []
+        output_ids = { LAMBDA: 0 }
+        output_offsets, output_buffer = array('i', [0, 0]), array('i')
+        def intern(output):
+            output = tuple(output)
+            if output not in output_ids:
+                output_ids[output] = len(output_offsets) - 1
+                for symbol in output:
+                    if symbol not in output_symbol_ids:
+                        output_symbol_ids[symbol] = len(output_symbols)
+                        output_symbols.append(symbol)
+                    output_buffer.append(output_symbol_ids[symbol])
+                output_offsets.append(len(output_buffer))
+            return output_ids[output]
+        
+        n_symbols = len(symbols)
+        sink = len(states)
+        delta = array('i', [sink]) * ((sink + 1) * n_symbols)
+        edge_output = array('i', [0]) * ((sink + 1) * n_symbols)
+        final_output = array('i', [NO_EDGE]) * (sink + 1)
+        for state in states:
+            base = state_ids[state] * n_symbols
+            for (input, output, target) in T.outgoing_edges_from(state):
+                if output is BOT:
+                    raise ValueError('edge from %s on %s has no output' % (state, input))
+                delta[base + symbol_ids[input]] = state_ids[target]
+                edge_output[base + symbol_ids[input]] = intern(output)
+            if T.state_output(state) is not BOT:
+                final_output[state_ids[state]] = intern(T.state_output(state))
+                
+        return CompiledTransducer(symbols, output_symbols, delta, edge_output, final_output,
+                                  output_offsets, output_buffer)
+        
+    def output(self, output_id):
+        '''Returns output string _output_id_ as a tuple of output symbols.'''
+        output = self.outputs[output_id]
+        if output is None:
+            output = self.outputs[output_id] = tuple(self.output_symbols[symbol_id]
+                for symbol_id in self.output_buffer[self.output_offsets[output_id]:
+                                                    self.output_offsets[output_id + 1]])
+        return output
+        
+    def encode(self, input):
+        '''Maps a sequence of input symbols to symbol ids. Unknown symbols map to the
+one-past-the-end id, which always leads to the sink state.'''
+        return array('i', [ self.symbol_ids.get(symbol, len(self.symbols)) for symbol in input ])
+        
+    def transduce(self, inputs):
+        '''Yields the output for each sequence of input symbols in _inputs_, or None
+where the transducer rejects it.'''
+        return self.transduce_encoded(self.encode(input) for input in inputs)
+        
+    def transduce_encoded(self, inputs):
+        '''Like transduce, for inputs already mapped to symbol ids by encode.'''
+        delta, edge_output, final_output = self.delta, self.edge_output, self.final_output
+        n_symbols = len(self.symbols)
+        sink = len(final_output) - 1
+        output = self.output
+        
+        for input in inputs:
+            state = 0
+            emitted = []
+            for symbol_id in input:
+                if symbol_id >= n_symbols:
+                    state = sink
+                    break
+                i = state * n_symbols + symbol_id
+                if edge_output[i]:
+                    emitted.append(edge_output[i])
+                state = delta[i]
+                
+            if final_output[state] == NO_EDGE:
+                yield None
+            else:
+                emitted.append(final_output[state])
+                yield tuple(chain.from_iterable(imap(output, emitted)))
+                
+    def transduce_array(self, inputs):
+        '''Runs a whole batch of equal-length encoded inputs at once with NumPy.
+_inputs_ is a (batch, length) integer array; returns the (batch, length) array of
+output ids emitted on each transition and the (batch,) array of final output ids,
+which is -1 for rejected inputs. Use output() to decode ids.'''
+        if numpy is None:
+            raise ImportError('transduce_array requires numpy')
+            
+        inputs = numpy.asarray(inputs, dtype=numpy.int64)
+        n_symbols = len(self.symbols)
+        # index the int32 tables in place, doing the arithmetic on indices in int64,
+        # since copying a table would cost time (and, for a mapped file, memory)
+        # in proportion to its size on every call
+        delta, edge_output, final_output = [ int32_view(column)
+            for column in (self.delta, self.edge_output, self.final_output) ]
+        sink = len(self.final_output) - 1
+        
+        # send unknown symbols to the sink, whose transitions all loop
+        unknown = inputs >= n_symbols
+        symbol_ids = numpy.where(unknown, 0, inputs)
+        states = numpy.zeros(inputs.shape[0], dtype=numpy.int64)
+        emitted = numpy.zeros(inputs.shape, dtype=numpy.int64)
+        if n_symbols == 0:
+            # every symbol is unknown, and there are no transitions to index
+            if inputs.shape[1]: states[:] = sink
+            return emitted, final_output[states].astype(numpy.int64)
+        for t in xrange(inputs.shape[1]):
+            states = numpy.where(unknown[:, t], sink, states)
+            i = states * n_symbols + symbol_ids[:, t]
+            emitted[:, t] = numpy.where(states == sink, 0, edge_output[i])
+            states = delta[i].astype(numpy.int64)
+            
+        return emitted, final_output[states].astype(numpy.int64)
+        
+    # file layout: header, a table of (offset, length in bytes) for each column
+    # in COLUMNS, then the columns themselves, each 8-byte aligned. Integer
+    # columns are little-endian int32; symbol tables are packed by pack_symbols.
+    MAGIC = 'OSTIACT\0'
+    VERSION = 1
+    HEADER = struct.Struct('<8sII')
+    SECTION = struct.Struct('<QQ')
+    COLUMNS = ('delta', 'edge_output', 'final_output', 'output_offsets', 'output_buffer')
+    
+    def save(self, fn):
+        '''Writes this transducer to _fn_ in the format read by load().'''
+        sections = [ int32_bytes(getattr(self, column)) for column in self.COLUMNS ]
+        sections.append(pack_symbols(self.symbols))
+        sections.append(pack_symbols(self.output_symbols))
+        
+        offset = align(self.HEADER.size + len(sections) * self.SECTION.size)
+        table = []
+        for section in sections:
+            table.append( (offset, len(section)) )
+            offset = align(offset + len(section))
+            
+        with open(fn, 'wb') as f:
+            f.write(self.HEADER.pack(self.MAGIC, self.VERSION, len(sections)))
+            for entry in table:
+                f.write(self.SECTION.pack(*entry))
+            for (offset, length), section in izip(table, sections):
+                f.write('\0' * (offset - f.tell()))
+                f.write(section)
+                
+    @staticmethod
+    def load(fn):
+        '''Maps a transducer written by save() into memory. The integer columns are
+views onto the mapping rather than copies (NumPy arrays if NumPy is installed),
+so loading costs only the symbol tables, and processes loading the same file
+share its pages.
+
+>>> import os, tempfile
+>>> C = ostia([(('a',), ('1',)), (('b', 'a'), ('2', '1'))]).compile()
+>>> fd, fn = tempfile.mkstemp(); os.close(fd)
+>>> C.save(fn)
+>>> D = CompiledTransducer.load(fn)
+>>> list(D.transduce([('b', 'a'), ('a', 'a')])) == list(C.transduce([('b', 'a'), ('a', 'a')]))
+True
+>>> os.remove(fn)
+'''
+        with open(fn, 'rb') as f:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            
+        header = CompiledTransducer.HEADER
+        magic, version, n_sections = header.unpack_from(mapping, 0)
+        if magic != CompiledTransducer.MAGIC:
+            raise ValueError('%s is not a compiled transducer' % fn)
+        if version != CompiledTransducer.VERSION:
+            raise ValueError('%s has unsupported version %d' % (fn, version))
+        table = [ CompiledTransducer.SECTION.unpack_from(mapping, header.size + i * CompiledTransducer.SECTION.size)
+                  for i in xrange(n_sections) ]
+                  
+        columns = [ int32_column(mapping, offset, length) for (offset, length) in table[:-2] ]
+        symbols, output_symbols = [ unpack_symbols(mapping, offset) for (offset, length) in table[-2:] ]
+        C = CompiledTransducer(symbols, output_symbols, *columns)
+        C.mapping = mapping
+        return C
+        
+    def __repr__(self):
+        return '<CompiledTransducer %d states %d symbols>' % (len(self.final_output) - 1, len(self.symbols))
+        
+def align(offset):
+    return (offset + 7) & ~7
+    
+def int32_bytes(column):
+    column = array('i', column)
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return column.tostring()
+    
+def pack_symbols(symbols):
+    '''Packs a symbol table as a tag (0 for str, 1 for unicode stored as UTF-8), a
+count, count + 1 int32 offsets and the concatenated symbols.'''
+    if all(isinstance(symbol, str) for symbol in symbols):
+        tag, encoded = 0, symbols
+    elif all(isinstance(symbol, unicode) for symbol in symbols):
+        tag, encoded = 1, [ symbol.encode('utf-8') for symbol in symbols ]
+    else:
+        raise TypeError('only str or unicode symbols can be saved')
+    offsets = [0]
+    for symbol in encoded:
+        offsets.append(offsets[-1] + len(symbol))
+    return struct.pack('<II', tag, len(symbols)) + int32_bytes(offsets) + ''.join(encoded)
+    
+def unpack_symbols(mapping, offset):
+    tag, n = struct.unpack_from('<II', mapping, offset)
+    offsets = struct.unpack_from('<%di' % (n + 1), mapping, offset + 8)
+    start = offset + 8 + 4 * (n + 1)
+    symbols = [ mapping[start + offsets[i]:start + offsets[i + 1]] for i in xrange(n) ]
+    if tag == 1:
+        symbols = [ symbol.decode('utf-8') for symbol in symbols ]
+    return symbols
+    
+def int32_column(mapping, offset, length):
+    '''A read-only view of _length_ bytes of little-endian int32s in _mapping_.'''
+    if numpy is not None:
+        return numpy.frombuffer(mapping, dtype='<i4', count=length // 4, offset=offset)
+    return MappedInt32s(mapping, offset, length // 4)
+    
+def int32_view(column):
+    '''Returns a NumPy view of an int32 column, without copying it.'''
+    if isinstance(column, numpy.ndarray):
+        return column
+    return numpy.frombuffer(column, dtype=numpy.int32)
+    
+class MappedInt32s(object):
+    '''Indexes int32s in a buffer in place, for when NumPy is not available.'''
+    INT32 = struct.Struct('<i')
+    
+    def __init__(self, mapping, offset, n):
+        self.mapping = mapping
+        self.offset = offset
+        self.n = n
+        
+    def __len__(self):
+        return self.n
+        
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(self.n)
+            return [ self[j] for j in xrange(start, stop, step) ]
+        if i < 0: i += self.n
+        if not 0 <= i < self.n:
+            raise IndexError('index out of range')
+        return self.INT32.unpack_from(self.mapping, self.offset + 4 * i)[0]
+        
 def flatten(lol):
     '''
 >>> list(flatten([ [1,2,3], [4,5] ]))
@@ -160,18 +783,46 @@ def each_pair(l):
     return izip(islice(l, 0, len(l)-1),
                 islice(l, 1, None))
 
-def build_ptt(data_pairs):
-    transducer = Transducer()
+def common_prefix_length(s, t):
+    '''
+>>> common_prefix_length('abcd', 'abd'), common_prefix_length('', 'ab')
+(2, 0)
+    '''
+    length = 0
+    for (a, b) in izip(s, t):
+        if a != b: break
+        length += 1
+    return length
+
+def build_ptt(data_pairs, transducer_class=Transducer, presorted=False):
+    '''Builds the prefix tree transducer for _data_pairs_ by walking the trie once per
+input and creating only the states it lacks. If _presorted_, the pairs are sorted
+by input, so the path to the previous input is reused and each input only walks
+its new suffix.
+
+>>> T = build_ptt([(('a',), ('1',)), (('a', 'b'), ('2',)), (('b',), ('3',))], presorted=True)
+>>> T.state_output(T.get_state(('a', 'b')))
+('2',)
+>>> sorted(T.state_label(state) for state in T.each_state())
+[(), ('a',), ('a', 'b'), ('b',)]
+    '''
+    transducer = transducer_class()
+    # path[i] is the state reached by the first i symbols of the previous input
+    path = [ transducer.get_state(LAMBDA) ]
+    previous = LAMBDA
     
     for (input, output) in data_pairs:
-        for (target_state_label, source_state_label) in each_pair(descending_prefixes_of(input)):
-            source_state = transducer.get_state(source_state_label) #??
-            target_state = transducer.get_state(target_state_label)
-            
-            transducer.add_transition(source_state, target_state_label[-1], LAMBDA, target_state)
+        shared = common_prefix_length(previous, input) if presorted else 0
+        del path[shared+1:]
+        
+        for i in xrange(shared, len(input)):
+            target_state = transducer.transition_target(path[-1], input[i])
+            if target_state is None:
+                target_state = transducer.add_child(path[-1], input[i], input[:i+1])
+            path.append(target_state)
             
-        target_state = transducer.get_state(input)
-        target_state.output = output
+        transducer.set_state_output(path[-1], output)
+        previous = input
         
     return transducer
     
@@ -215,34 +866,51 @@ def lcp(files):
 
     return files[0]
     
+def common_prefix(w1, w2):
+    '''
+>>> common_prefix('123', '124'), common_prefix(BOT, '12'), common_prefix(BOT, BOT)
+('12', '12', None)
+    '''
+    # treat BOT as nothing
+    if w1 is BOT: return w2
+    if w2 is BOT: return w1
+    return w1[:common_prefix_length(w1, w2)]
+    
 def make_onward(T, state):
-
-    for (input, output, outgoing_state) in T.outgoing_edges_from(state):
-        f_a = make_onward(T, outgoing_state)
-        debug('f_a: %s', f_a)
-        # print 'setting edge output string %s from %s on %s'%(T.edge_output_string(state, input) + f_a, state, input)
-        T.set_edge_output_string(state, input,
-                                 T.edge_output_string(state, input) + f_a)
-        # print 'T here:',T
-    # if state.label=='':
-    #     import pdb;pdb.set_trace()
-        
-    # index 1 is the output string
-    # import pdb;pdb.set_trace()
-    outgoing_edges_outputs = [ e[1] for e in T.outgoing_edges_from(state) ]
-    if outgoing_edges_outputs:
-        f = lcp( [ state.output, lcp(outgoing_edges_outputs) ] )
-    else:
-        f = state.output
-    len_f = 0 if (f is None) else len(f)
+    '''Moves output as close to _state_ as possible and returns the longest common
+prefix of everything _state_ can output. The walk is post-order with an explicit
+stack, and each state's prefix is accumulated as its children finish, so deep
+transducers neither hit the recursion limit nor recompute prefixes.'''
+    initial_state = T.get_state(LAMBDA)
+    # each frame is [state, its remaining edges, the edge being visited,
+    #                the common prefix of its output and the edges done so far]
+    stack = [ [state, T.outgoing_edges_from(state), None, T.state_output(state)] ]
     
-    if len_f > 0 and not state.label == LAMBDA:
-        for (input, output, outgoing_state) in T.outgoing_edges_from(state):
-            T.set_edge_output_string(state, input,
-                                     T.edge_output_string(state, input)[len_f:])
+    while stack:
+        frame = stack[-1]
+        for (input, output, outgoing_state) in frame[1]:
+            frame[2] = input
+            stack.append( [outgoing_state, T.outgoing_edges_from(outgoing_state), None,
+                           T.state_output(outgoing_state)] )
+            break
+        else:
+            stack.pop()
+            state, _, _, f = frame
+            len_f = 0 if (f is None) else len(f)
+    
+            if len_f > 0 and not state == initial_state:
+                for (input, output, outgoing_state) in T.outgoing_edges_from(state):
+                    T.set_edge_output_string(state, input, output[len_f:])
         
-        if state.output is not BOT:
-            state.output = state.output[len_f:]
+                if T.state_output(state) is not BOT:
+                    T.set_state_output(state, T.state_output(state)[len_f:])
+                    
+            if stack:
+                parent = stack[-1]
+                debug('f_a: %s', f)
+                f_a = T.edge_output_string(parent[0], parent[2]) + f
+                T.set_edge_output_string(parent[0], parent[2], f_a)
+                parent[3] = common_prefix(parent[3], f_a)
 
     return f
     
@@ -272,63 +940,61 @@ def pushback(T, state1, state2, input):
         T.set_edge_output_string(state2_successor, input,
                                  u2 + T.edge_output_string(state2_successor, input))
 
-    if state1_successor.output is not BOT:
-        state1_successor.output = u1 + state1_successor.output
-    if state2_successor.output is not BOT:
-        state2_successor.output = u2 + state2_successor.output
+    if T.state_output(state1_successor) is not BOT:
+        T.set_state_output(state1_successor, u1 + T.state_output(state1_successor))
+    if T.state_output(state2_successor) is not BOT:
+        T.set_state_output(state2_successor, u2 + T.state_output(state2_successor))
     
-def merge(orig_T, red_states, red_state, blue_state):
+def merge(T, red_states, red_state, blue_state, dry_run=False):
     # for any state incoming to blue_state:
     #     point it to red_state instead
     # fold(T, red_state, blue_state)
-    T = orig_T#copy.deepcopy(orig_T)
-    
-    # red_state = T.get_state(red_state.label)
-    # blue_state = T.get_state(blue_state.label)
+    # every mutation from here on is journaled, so a failed merge is undone
+    # in time proportional to the work it did
+    T.begin()
     
-    reassignments = {}
     # for every state that used to point to blue_state,
     for incoming_state, input in T.incoming_states_to(blue_state):
         # point it to red_state instead
-        
-        previous_target_state = T.edge_target_state(incoming_state, input)
         debug('setting destination of %s on %s from %s to %s',
-            incoming_state, input, previous_target_state, red_state)
-        reassignments[ (incoming_state, input) ] = previous_target_state
+            incoming_state, input, T.edge_target_state(incoming_state, input), red_state)
         T.set_edge_target_state(incoming_state, input, red_state)
 
     result = fold(T, red_states, red_state, blue_state)
 
     if result is None:
-        # roll back
-        for (incoming_state, input), old_target_state in reassignments.items():
-            debug('rolling back destination of %s on %s from %s to %s',
-                incoming_state, input, T.edge_target_state(incoming_state, input), old_target_state)
-            T.set_edge_target_state(incoming_state, input, old_target_state)
+        debug('rolling back merge of %s into %s', blue_state, red_state)
+        T.rollback()
+    elif dry_run:
+        T.rollback()
+    else:
+        T.commit()
             
     return result
     
 def fold(T, red_states, q, q_):
-    w = outputs_are_equal(q.output, q_.output)
+    w = outputs_are_equal(T.state_output(q), T.state_output(q_))
     if w is None:
         return None
     else:
-        old_q_output = q.output
-        q.output = w
+        T.set_state_output(q, w)
 
         for (input_, output_, outgoing_state_) in T.outgoing_edges_from(q_):
             found_matching = False
             for (input, output, outgoing_state) in T.outgoing_edges_from(q):
                 if input == input_:
-                    if T.edge_target_state(q, input) in red_states:
-                    # if T.edge_output_string(q, input) != T.edge_output_string(q_, input):
-                        # import pdb;pdb.set_trace()
+                    # pushing back into a red state would change a part of the
+                    # transducer already settled, but nothing is pushed back on
+                    # this side if its output is a prefix of the other's
+                    red_output = T.edge_output_string(q, input)
+                    if T.edge_target_state(q, input) in red_states and \
+                       T.edge_output_string(q_, input)[:len(red_output)] != red_output:
                         debug('%s is a red state, failing', T.edge_target_state(q, input))
-                        q.output = old_q_output
                         return None
                     else:
                         pushback(T, q, q_, input)
-                        fold(T, red_states, T.edge_target_state(q, input), T.edge_target_state(q_, input))
+                        if fold(T, red_states, T.edge_target_state(q, input), T.edge_target_state(q_, input)) is None:
+                            return None
                         found_matching = True
             
             if not found_matching:
@@ -337,55 +1003,295 @@ def fold(T, red_states, q, q_):
                                  T.edge_target_state(q_, input_))                
         return T
         
-def ostia(data):
-    T = build_ptt(data)
-    make_onward(T, T.get_state(LAMBDA))
+# orderings for the blue state queue, as a key on (transducer, state)
+BLUE_ORDERS = {
+    'fifo': lambda T, state: 0,
+    'lex': lambda T, state: T.state_label(state),
+    'shortest': lambda T, state: (len(T.state_label(state)), T.state_label(state)),
+}
+
+class BlueStates(object):
+    '''The blue states of OSTIA: a heap ordered by one of BLUE_ORDERS, with a set
+alongside it for membership tests.
+
+>>> T = build_ptt([(('b', 'a'), ('1',)), (('a',), ('2',)), (('c',), ('3',))])
+>>> blue_states = BlueStates(T, 'shortest')
+>>> for label in [('b', 'a'), ('c',), ('a',), ('c',)]: blue_states.add(T.get_state(label))
+>>> [blue_states.pop().label for _ in xrange(len(blue_states))]
+[('a',), ('c',), ('b', 'a')]
+'''
+    def __init__(self, T, order='fifo'):
+        self.T = T
+        self.key = BLUE_ORDERS[order]
+        self.heap = []
+        self.members = set()
+        # breaks ties in insertion order
+        self.pushed = count()
+        
+    def add(self, state):
+        if state not in self.members:
+            self.members.add(state)
+            heappush(self.heap, (self.key(self.T, state), next(self.pushed), state))
+            
+    def pop(self):
+        state = heappop(self.heap)[2]
+        self.members.remove(state)
+        return state
+        
+    def __contains__(self, state):
+        return state in self.members
+    def __len__(self):
+        return len(self.heap)
+    def __repr__(self):
+        return repr([ entry[2] for entry in sorted(self.heap) ])
+        
+def first_merge(T, red_order, red_states, q):
+    '''Merges _q_ into the first red state in _red_order_ that it merges with and
+returns that state, or returns None if there is none.'''
+    for p in red_order:
+        debug('TRYING MERGE %s and %s',p,q)
+        if merge(T, red_states, p, q) is not None:
+            debug('SUCCEEDED MERGE %s and %s merged_T %s', p, q, T)
+            return p
+        else:
+            debug('FAILED MERGE %s and %s',p,q)
+            
+    debug('exhausted all merges between %s and red states', q)
+    return None
     
-    red_states = { T.get_state(LAMBDA) }
-    blue_states = [ T.get_state(input) for (input, output) in data if len(input) == 1 ]
+def first_mergeable(T, red_order, red_states, q, candidates):
+    '''Returns the first index in _candidates_ whose red state _q_ would merge into,
+or None, leaving T unchanged.'''
+    for i in candidates:
+        if merge(T, red_states, red_order[i], q, dry_run=True) is not None:
+            return i
+    return None
 
-    while blue_states:
+def red_blue(T, order, find_merge):
+    '''Runs the OSTIA red/blue loop over the onward transducer T, calling
+_find_merge_(T, red_order, red_states, q) to merge each blue state q.'''
+    red_order = [ T.get_state(LAMBDA) ]
+    red_states = set(red_order)
+    blue_states = BlueStates(T, order)
+    # the state whose outgoing edges may have new blue successors
+    changed_state = T.get_state(LAMBDA)
+
+    while True:
+        # a merge only adds edges out of the red state it merged into, and
+        # promoting a state only adds its own edges, so that state is the
+        # only one whose successors can have become blue
+        for (input, output, outgoing_state) in T.outgoing_edges_from(changed_state):
+            if outgoing_state not in red_states:
+                blue_states.add(outgoing_state)
+        if not blue_states: break
+        
         debug('blue states: %s',blue_states)
-        debug('red states: %s',red_states)
+        debug('red states: %s',red_order)
         
-        q = blue_states.pop(0)
+        q = blue_states.pop()
         debug('POP blue state: %s', q)
         
-        for p in red_states:
-            debug('TRYING MERGE %s and %s',p,q)
-            merged_T = merge(T, red_states, p, q)
-            if merged_T is not None:
-                # accept merged as the new T
-                debug('SUCCEEDED MERGE %s and %s merged_T %s', p, q, merged_T)
-                T = merged_T
-                break
-            else:
-                debug('FAILED MERGE %s and %s',p,q)
-        else:
-            debug('exhausted all merges between %s and red states', q)
+        changed_state = find_merge(T, red_order, red_states, q)
+        if changed_state is None:
             red_states.add(q)
+            red_order.append(q)
+            changed_state = q
+                    
+    return T
+    
+def worth_speculating(red_order, processes):
+    # with fewer red states, the round trips cost more than the merges
+    return len(red_order) >= 2 * processes
+    
+class SpeculativeMerges(object):
+    '''A find_merge for red_blue which tries the candidate merges for each blue state
+on a pool of worker processes. Every worker is forked with a replica of the
+transducer and runs the same deterministic red/blue loop, so red states can be
+named by their index in red_order and the only traffic is one index each way per
+blue state. The first mergeable red state in red_order wins, exactly as in
+first_merge.'''
+    def __init__(self, T, order, processes):
+        self.processes = processes
+        self.connections = []
+        self.workers = []
+        for worker in xrange(processes):
+            connection, worker_connection = Pipe()
+            process = Process(target=speculate, args=(T, order, worker, processes, worker_connection))
+            process.daemon = True
+            process.start()
+            self.connections.append(connection)
+            self.workers.append(process)
             
-        # update blue_states to contain
-        # any state which a red state points to, but is not red
-        for red_state in red_states:
-            # print 'considering red state %s' % red_state
+    def __call__(self, T, red_order, red_states, q):
+        if not worth_speculating(red_order, self.processes):
+            return first_merge(T, red_order, red_states, q)
             
-            for (input, output, outgoing_state) in T.outgoing_edges_from(red_state):
-                # if outgoing_state is None: continue
-                if outgoing_state not in red_states:
-                    if outgoing_state not in blue_states: # to get set behaviour
-                        blue_states.append(outgoing_state)
-                    
+        firsts = [ i for i in (connection.recv() for connection in self.connections)
+                   if i is not None ]
+        first = min(firsts) if firsts else None
+        for connection in self.connections:
+            connection.send(first)
+            
+        if first is None: return None
+        merge(T, red_states, red_order[first], q)
+        return red_order[first]
+        
+    def join(self):
+        for process in self.workers:
+            process.join()
+        
+def speculate(T, order, worker, processes, connection):
+    '''The body of a SpeculativeMerges worker.'''
+    set_verbose(False)
+    
+    def find_merge(T, red_order, red_states, q):
+        if not worth_speculating(red_order, processes):
+            return first_merge(T, red_order, red_states, q)
+            
+        # try this worker's share of the red states, then apply whatever was chosen
+        connection.send(first_mergeable(T, red_order, red_states, q,
+                                        xrange(worker, len(red_order), processes)))
+        first = connection.recv()
+        if first is None: return None
+        merge(T, red_states, red_order[first], q)
+        return red_order[first]
+        
+    red_blue(T, order, find_merge)
+    connection.close()
+    
+def ostia(data, transducer_class=Transducer, order='fifo', processes=None):
+    '''Learns a subsequential transducer from _data_, a sequence of (input, output)
+pairs. With _processes_ > 1, candidate merges are tried speculatively on that many
+worker processes; the result is identical to the serial one, except that a
+Transducer becomes an OrderedTransducer, which may learn another (equally
+consistent) transducer, as the order of edges decides which states are merged first.'''
+    if processes > 1 and transducer_class is Transducer:
+        # a dict's order can change when an edge is rolled back, which would set
+        # the replicas apart
+        transducer_class = OrderedTransducer
+    T = build_ptt(data, transducer_class)
+    make_onward(T, T.get_state(LAMBDA))
+    
+    if processes > 1:
+        merges = SpeculativeMerges(T, order, processes)
+        red_blue(T, order, merges)
+        merges.join()
+    else:
+        red_blue(T, order, first_merge)
     return T
     
-def interpret_piped(fn):
-    data = []
-    for line in file(fn, 'r'):
+class Metrics(object):
+    '''Counters, timers and peak memory growth (in KB) for the phases of OSTIA. While
+a Metrics is active (as a context manager), the module's functions are replaced by
+instrumented wrappers that record into it; outside, the originals run untouched,
+so a disabled Metrics costs nothing at all. Only calls made through this module's
+globals are seen, as ostia's own calls are.
+
+>>> with Metrics() as m:
+...     T = ostia([(('a',), ('1',)), (('a', 'a'), ('1', '1'))])
+>>> m.counters['merge.attempts'], m.counters['merge.successes'], m.maxima['fold.depth']
+(1, 1, 2)
+>>> sorted(m.timers)
+['make_onward', 'ptt', 'red_blue']
+'''
+    def __init__(self):
+        self.counters = defaultdict(int)
+        self.maxima = defaultdict(int)
+        self.timers = defaultdict(float)
+        self.memory = defaultdict(int)
+        self.originals = None
+        self.fold_depth = 0
+        
+    def __enter__(self):
+        module = globals()
+        self.originals = dict( (name, module[name]) for name in
+            ('build_ptt', 'make_onward', 'merge', 'fold', 'red_blue') )
+        module.update(
+            build_ptt=self.timed('ptt', self.originals['build_ptt']),
+            make_onward=self.timed('make_onward', self.originals['make_onward']),
+            red_blue=self.timed('red_blue', self.originals['red_blue']),
+            merge=self.merge,
+            fold=self.fold)
+        return self
+        
+    def __exit__(self, *exc_info):
+        globals().update(self.originals)
+        self.originals = None
+        
+    def timed(self, name, f):
+        def timed_f(*args, **kwargs):
+            start, rss = time.time(), resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            try:
+                return f(*args, **kwargs)
+            finally:
+                self.timers[name] += time.time() - start
+                self.memory[name] += resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss
+        return timed_f
+        
+    def merge(self, *args, **kwargs):
+        self.counters['merge.attempts'] += 1
+        result = self.originals['merge'](*args, **kwargs)
+        if result is None:
+            self.counters['merge.rollbacks'] += 1
+        elif kwargs.get('dry_run'):
+            self.counters['merge.speculations'] += 1
+        else:
+            self.counters['merge.successes'] += 1
+        return result
+        
+    def fold(self, *args, **kwargs):
+        self.counters['fold.calls'] += 1
+        self.fold_depth += 1
+        self.maxima['fold.depth'] = max(self.maxima['fold.depth'], self.fold_depth)
+        try:
+            return self.originals['fold'](*args, **kwargs)
+        finally:
+            self.fold_depth -= 1
+            
+    def report(self):
+        lines = [ '%-20s %12.3fs %10d KB' % (name, t, self.memory[name])
+                  for (name, t) in sorted(self.timers.items()) ]
+        lines.extend( '%-20s %12d' % (name, n) for (name, n) in sorted(self.counters.items()) )
+        lines.extend( '%-20s %12d (max)' % (name, n) for (name, n) in sorted(self.maxima.items()) )
+        return '\n'.join(lines)
+        
+def piped_pairs(lines, dedupe=False):
+    '''Parses lines holding a Mandarin and a Cantonese word, each a run of |-terminated
+symbols, into (Cantonese, Mandarin) pairs of symbol tuples. Both are reversed,
+since OSTIA learns the mapping right to left. Symbols are interned as they are read;
+with _dedupe_, a pair is only yielded the first time it is seen.
+
+>>> list(piped_pairs(['ni|hao| nei|hou|', '', 'ni|hao| nei|hou|'], dedupe=True))
+[(('hou', 'nei'), ('hao', 'ni'))]
+    '''
+    seen = set()
+    for line in lines:
         line = line.rstrip()
+        if not line: continue
+        
         mando, canto = line.split()
-        data.append( (tuple(reversed(canto.split('|')[:-1])), tuple(reversed(mando.split('|')[:-1]))) )
-        # data.append( (tuple(canto.split('|')[:-1]), tuple(mando.split('|')[:-1])) )
-    return data
+        pair = ( tuple(intern(symbol) for symbol in reversed(canto.split('|')[:-1])),
+                 tuple(intern(symbol) for symbol in reversed(mando.split('|')[:-1])) )
+        if dedupe:
+            if pair in seen: continue
+            seen.add(pair)
+        yield pair
+
+def read_piped(fn, dedupe=False, use_mmap=False):
+    '''Streams the training pairs in _fn_ (see piped_pairs) one line at a time, so that
+build_ptt can consume them without the whole corpus being held in memory. With
+_use_mmap_, the file is mapped rather than read through a buffer.'''
+    with open(fn, 'rb') as f:
+        if use_mmap:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            lines = iter(mapping.readline, '')
+        else:
+            lines = f
+        for pair in piped_pairs(lines, dedupe):
+            yield pair
+
+def interpret_piped(fn):
+    return list(read_piped(fn))
 
 if __name__ == '__main__':
 #    T = ostia([ ('abc', '101'), ('aec', '121'), ('fg', '345'), ('fh', '320') ])
@@ -395,10 +1301,15 @@ if __name__ == '__main__':
         doctest.testmod()
         
     else:
+        set_verbose('-v' in sys.argv[1:])
         # data = [ ('a', '1'), ('b', '1'), ('aa', '01'), ('ab', '01'), ('aaa', '001'), ('abab', '0101') ]
         # data = [ ('abc', 'abc'), ('def', 'def'), ('def', 'deg')]
-        data = interpret_piped('piped')
-        T = ostia(data)
+        if '-m' in sys.argv[1:]:
+            with Metrics() as metrics:
+                T = ostia(read_piped('piped'))
+            print >>sys.stderr, metrics.report()
+        else:
+            T = ostia(read_piped('piped'))
         print T.as_graph()
         
         # T = build_ptt(data)